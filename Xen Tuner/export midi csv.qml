@@ -60,6 +60,31 @@ MuseScore {
         }
       }
 
+      /**
+       * Sorts .mid.csv rows (lines of `staff, pitch, tick, ...`) by tick, keeping rows of the same
+       * tick in their original order.
+       *
+       * Voices are tuned one after another, so the rows of a staff are only in tick order once
+       * sorted. generate-mpe.py --stream needs the rows of each staff in tick order.
+       */
+      function sortRowsByTick(rowsText) {
+        var rows = rowsText.split('\n').filter(function(row) {
+          return row.length > 0;
+        }).map(function(row, idx) {
+          return { tick: parseFloat(row.split(',')[2]), idx: idx, row: row };
+        });
+
+        rows.sort(function(a, b) {
+          return (a.tick - b.tick) || (a.idx - b.idx);
+        });
+
+        var text = '';
+        for (var i = 0; i < rows.length; i++) {
+          text += rows[i].row + '\n';
+        }
+        return text;
+      }
+
       onRun: {
         // When you want to find which import has a syntax error, uncomment this line
         // Fns.log(JSON.stringify(Fns));
@@ -192,6 +217,9 @@ MuseScore {
         // Go through each staff + voice to start tuning notes.
 
         for (var staff = startStaff; staff <= endStaff; staff++) {
+          // Rows of the notes in this staff, from all voices.
+          var staffRows = '';
+
           for (var voice = 0; voice < 4; voice++) {
             // After each voice & rewind,
             // reset all configs back to default
@@ -279,13 +307,13 @@ MuseScore {
                     // iterate through all grace chords
                     var notes = graceChords[i].notes;
                     for (var j = 0; j < notes.length; j++) {
-                      midiText += Fns.tuneNote(notes[j], parms.currKeySig, parms.currTuning,
+                      staffRows += Fns.tuneNote(notes[j], parms.currKeySig, parms.currTuning,
                         tickOfThisBar, tickOfNextBar, cursor, reusedBarState, newElement, true, velo);
                     }
                   }
                   var notes = cursor.element.notes;
                   for (var i = 0; i < notes.length; i++) {
-                    midiText += Fns.tuneNote(notes[i], parms.currKeySig, parms.currTuning,
+                    staffRows += Fns.tuneNote(notes[i], parms.currKeySig, parms.currTuning,
                       tickOfThisBar, tickOfNextBar, cursor, reusedBarState, newElement, true, velo);
                   }
                 }
@@ -293,6 +321,8 @@ MuseScore {
               cursor.next();
             }
           }
+
+          midiText += sortRowsByTick(staffRows);
         }
 
         // Export midiText to file.
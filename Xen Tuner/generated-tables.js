@@ -1,3 +1,4 @@
+// Tables hash: b2a30e331cba4024cada6e19a96a2a233a628d3c0fd7c0953ecea21e0a9717fc
 var CODE_TO_LABELS = [
     null,
     ['noSym','NONE'],
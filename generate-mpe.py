@@ -18,118 +18,1582 @@
 """
 Converts the exported .mid.csv file into MPE (MIDI Polyphonic Expression) .mid files.
 
-Creates one file per part.
+Creates one track per part, or one file per part with `--split`.
 
-Before you can run this, you need to install MIDIUtil from pip (Python's package manager).
+No extra Python packages are needed, the .mid file is encoded by this script directly.
 
-Windows: `py -m pip install MIDIUtil`
+How to use: `python3 generate-mpe.py <path-to-file.mid.csv>`
 
-Others: `python3 -m pip install MIDIUtil`
+To convert many files at once, pass several files, directories or glob patterns, e.g.
+`python3 generate-mpe.py scores/ "exports/*.mid.csv" -j 0`. Files whose .mid is newer than the
+.mid.csv are skipped unless `--force` is given.
 
-How to use: `python3 generate-mpe.py <path-to-file.mid.csv>`
+Each sounding note gets its own MPE channel. Use `--overflow spill` to move notes that don't fit
+in the 15 channels of a staff into extra tracks, instead of cutting off the oldest note.
+
+Use `--cache` when re-exporting a score after small changes. Encoded tracks are kept in a
+.mid.cache folder next to the .mid file, and only the staves that changed are encoded again.
+
+Use `--jobs N` to encode staves in parallel on N processes.
+
+To re-render the same export many times, convert it once to the binary .mid.bin format with
+`--to-bin`. .mid.bin files are read without any text parsing, and can be used in place of the
+.mid.csv file.
+
+Use `-` as the path to read the .mid.csv (or .mid.bin) from stdin and write the .mid to stdout,
+e.g. `... | python3 generate-mpe.py - --stream | renderer`. Use `-o` to choose where the output
+goes instead (`-o -` for stdout).
+
+For very large exports, use `--stream` to encode notes as soon as they are read. This needs the
+notes of each staff to be sorted by tick in the .mid.csv file (the Export MIDI CSV plugin sorts
+them), and saves keeping every note until the whole file is read. The encoded tracks are still
+built in memory, so memory use grows with the size of the .mid file either way.
+
+To find out why a conversion is slow, use `--profile` to print how long each stage took, or
+`--profile out.pstats` to save a cProfile of the conversion.
 """
 
 import argparse
+from array import array
+import concurrent.futures
+import cProfile
+import contextlib
 import csv
-from typing import Dict, List, Union
-import midiutil
-
-argparser = argparse.ArgumentParser("generate-mpe")
-argparser.add_argument("filepath", help="Path to the .mid.csv file")
-args = argparser.parse_args()
+import functools
+import glob
+import hashlib
+import heapq
+import io
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
 
 # Make sure you set this number to match the pitch band range setting of
-# your VST. This number is in semitones.
+# your VST. This number is in semitones. Can also be set with --pitchbend-range.
 PITCHBEND_RANGE = 2
 
-try:
-    with open(args.filepath, 'r') as f:
-        contents = f.read().splitlines()
-        ticks_per_quarter = int(contents[0])
-        
-        reader = csv.reader(contents[1:], delimiter=',')
-        
-        # Dict of staff to list of notes
-        staff_notes: Dict[int, List[List[Union[int, float]]]] = {}
-        
-        tempos = []
-        
-        max_staff = -1
-        
-        first_tick = 1e9
-        
-        for row in reader:
+CSV_EXTENSION = ".mid.csv"
+BIN_EXTENSION = ".mid.bin"
+CACHE_EXTENSION = ".cache"
+"""
+Added to the .mid file path to get the folder where encoded tracks are cached (see `--cache`).
+"""
+
+PART_WRITE_BUFFER_SIZE = 1 << 20
+"""
+Write buffer size used when writing one .mid file per staff (see `--split`).
+"""
+
+STDIO_PATH = "-"
+"""
+Input path meaning stdin, or output path meaning stdout.
+"""
+
+TEMPO_STAFF = -2
+"""
+Rows with this staff number are tempo changes: `-2, <bpm>, <tick>`
+"""
+
+END_OF_TRACK = b"\x00\xFF\x2F\x00"
+"""
+End of track meta event (with a delta time of 0).
+"""
+
+EMPTY_TRACK = b"MTrk" + struct.pack(">L", len(END_OF_TRACK)) + END_OF_TRACK
+"""
+Track chunk containing only the end of track meta event. Written for staff indices that have no
+notes so that staff n is still track n + 1 (after the conductor track).
+"""
+
+MPE_MEMBER_CHANNELS = range(15)
+"""
+Channels 0-14 are the member channels of the upper zone, each sounding note gets its own channel.
+"""
+
+def mpe_configuration(pitchbend_range: int) -> bytes:
+    """
+    MIDI messages sent at the start of every track: the MPE configuration, then the pitch bend
+    range of every member channel.
+
+    The delta time of the first message is left out, as it is always the first event.
+    """
+    # Send MPE configuration RPN (MSB 00, LSB 06)
+    # upper zone mpe (send on channel 15 to use 0-14 as the zone)
+    # Data MSB: 0xF (assigns 15 channels to zone)
+    messages = bytearray(
+        b"\xBF\x65\x00"      # CC 101: RPN MSB 00
+        b"\x00\xBF\x64\x06"  # CC 100: RPN LSB 06 (MPE configuration message)
+        b"\x00\xBF\x06\x0F"  # CC 6: Data entry MSB
+    )
+
+    # Pitch bend sensitivity RPN (MSB 00, LSB 00), in semitones (data MSB) and cents (data LSB).
+    # Sent to each member channel so that synths without MPE support also get the right range.
+    for channel in MPE_MEMBER_CHANNELS:
+        status = 0xB0 | channel
+        messages += bytes((
+            0, status, 101, 0,
+            0, status, 100, 0,
+            0, status, 6, pitchbend_range,
+            0, status, 38, 0,
+        ))
+
+    return bytes(messages)
+
+
+OVERFLOW_STEAL = "steal"
+OVERFLOW_SPILL = "spill"
+OVERFLOW_POLICIES = [OVERFLOW_STEAL, OVERFLOW_SPILL]
+"""
+What to do with a note when all member channels are busy:
+
+- steal: cut off the oldest sounding note and reuse its channel. If that note starts on the same
+  tick, it is dropped instead.
+- spill: put the note in an extra track, written after the staff tracks.
+"""
+
+# Order of events that happen on the same tick.
+ORDER_NOTE_OFF = 0
+ORDER_PITCH_BEND = 1
+ORDER_NOTE_ON = 2
+
+Row = Tuple[int, float, int, int, int, float]
+"""
+A parsed .mid.csv row: `(staff, pitch, tick, duration, velocity, cents)`.
+
+For tempo rows, `staff` is `TEMPO_STAFF`, `pitch` is the bpm and the other fields after `tick` are 0.
+"""
+
+
+def read_mid_csv(f: Iterable[str]) -> Tuple[int, Iterator[Row]]:
+    """
+    Reads the ticks per quarter note header of the .mid.csv file (or any iterable of its lines) and
+    returns it together with a generator that lazily parses the remaining rows one at a time.
+
+    The file is never read into memory as a whole, so the file must stay open while the rows are
+    being consumed.
+    """
+    f = iter(f)
+    ticks_per_quarter = int(next(f, ""))
+    return ticks_per_quarter, _parse_rows(csv.reader(f, delimiter=','))
+
+
+def _parse_rows(reader) -> Iterator[Row]:
+    for row in reader:
+        if len(row) == 0:
+            continue
+
+        try:
             staff = int(float(row[0]))
             tick = int(float(row[2]))
-            if staff > max_staff:
-                max_staff = staff
-            
+
+            if staff == TEMPO_STAFF:
+                # row[1] is bpm, row[2] is tick.
+                yield (staff, float(row[1]), tick, 0, 0, 0.0)
+                continue
+
+            row = (staff, int(float(row[1])), tick, int(float(row[3])), int(float(row[4])), float(row[5]))
+        except (IndexError, ValueError):
+            # The header line was read before the csv reader, so line numbers are one off.
+            raise ValueError(f"Invalid row on line {reader.line_num + 1}: {','.join(row)}") from None
+
+        yield row
+
+
+BIN_HEADER = struct.Struct("<4sII")
+"""
+Header of the binary .mid.bin format: magic bytes `BIN_MAGIC`, format version, ticks per quarter.
+"""
+
+BIN_MAGIC = b"XTMB"
+BIN_VERSION = 1
+
+BIN_RECORD = struct.Struct("<hhiihd")
+"""
+Fixed-width little-endian record of the binary .mid.bin format, one per .mid.csv row:
+`staff, pitch, tick, duration, velocity, cents` (22 bytes).
+
+Tempo records have `staff == TEMPO_STAFF`, and the bpm is stored in the `cents` field.
+"""
+
+
+def read_mid_bin(buffer) -> Tuple[int, Iterator[Row]]:
+    """
+    Reads a binary .mid.bin file from a buffer (e.g. an `mmap`), and returns the ticks per quarter
+    note together with a generator of rows, just like `read_mid_csv`.
+
+    Records are unpacked straight out of the buffer, nothing is copied or parsed from text.
+    """
+    if len(buffer) < BIN_HEADER.size:
+        raise ValueError("Not a .mid.bin file: file is too short.")
+
+    (magic, version, ticks_per_quarter) = BIN_HEADER.unpack_from(buffer, 0)
+
+    if magic != BIN_MAGIC:
+        raise ValueError("Not a .mid.bin file.")
+    if version != BIN_VERSION:
+        raise ValueError(f".mid.bin format version {version} is not supported.")
+    if (len(buffer) - BIN_HEADER.size) % BIN_RECORD.size != 0:
+        raise ValueError("The .mid.bin file is truncated.")
+
+    return ticks_per_quarter, _unpack_records(buffer)
+
+
+def _unpack_records(buffer) -> Iterator[Row]:
+    # unpack_from doesn't hold on to the buffer, so the mmap can be closed as soon as reading stops.
+    unpack_from = BIN_RECORD.unpack_from
+    for offset in range(BIN_HEADER.size, len(buffer), BIN_RECORD.size):
+        (staff, pitch, tick, duration, velocity, cents) = unpack_from(buffer, offset)
+        if staff == TEMPO_STAFF:
+            yield (staff, cents, tick, 0, 0, 0.0)
+        else:
+            yield (staff, pitch, tick, duration, velocity, cents)
+
+
+def write_mid_bin(rows: Iterator[Row], ticks_per_quarter: int, f: BinaryIO):
+    """
+    Writes parsed rows to a binary .mid.bin file, so that an export only needs to be parsed from
+    text once.
+    """
+    f.write(BIN_HEADER.pack(BIN_MAGIC, BIN_VERSION, ticks_per_quarter))
+
+    pack = BIN_RECORD.pack
+
+    try:
+        for (staff, pitch, tick, duration, velocity, cents) in rows:
+            if staff == TEMPO_STAFF:
+                f.write(pack(staff, 0, tick, 0, 0, pitch))
+            else:
+                f.write(pack(staff, pitch, tick, duration, velocity, cents))
+    except struct.error as e:
+        raise ValueError(f"Value out of range for the .mid.bin format: {e}")
+
+
+@contextlib.contextmanager
+def open_mid_rows(filepath: str, timer: Optional["StageTimer"] = None
+                  ) -> Iterator[Tuple[int, Iterator[Row]]]:
+    """
+    Opens a .mid.csv or .mid.bin file (decided by the file extension), and yields
+    `(ticks_per_quarter, rows)`. The rows must be consumed before the context exits.
+
+    If `timer` is given, time spent reading lines and parsing rows is counted towards the "read"
+    and "parse" stages.
+
+    If `filepath` is `STDIO_PATH`, reads from stdin instead. .mid.csv rows are parsed as they
+    arrive, so conversion can start before the upstream exporter has finished writing. A .mid.bin
+    on stdin (recognised by its magic bytes) is read whole, as a pipe can't be memory-mapped.
+    """
+    def read_lines(f) -> Tuple[int, Iterator[Row]]:
+        if timer is None:
+            return read_mid_csv(f)
+        (ticks_per_quarter, rows) = read_mid_csv(timer.timed(f, "read"))
+        return ticks_per_quarter, timer.timed(rows, "parse", "rows")
+
+    def read_buffer(buffer) -> Tuple[int, Iterator[Row]]:
+        (ticks_per_quarter, rows) = read_mid_bin(buffer)
+        if timer is None:
+            return ticks_per_quarter, rows
+        return ticks_per_quarter, timer.timed(rows, "parse", "rows")
+
+    if filepath == STDIO_PATH:
+        stdin = sys.stdin.buffer
+        if stdin.peek(len(BIN_MAGIC))[:len(BIN_MAGIC)] == BIN_MAGIC:
+            yield read_buffer(stdin.read())
+        else:
+            yield read_lines(io.TextIOWrapper(stdin))
+    elif filepath.endswith(BIN_EXTENSION):
+        with open(filepath, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            yield read_buffer(buffer)
+    else:
+        with open(filepath, 'r') as f:
+            yield read_lines(f)
+
+
+class StageTimer:
+    """
+    Measures how long each stage of a conversion takes, for `--profile`.
+
+    Time is always counted towards exactly one stage, the one last set with `switch()`, so nested
+    stages (e.g. reading lines while parsing rows) don't count the same time twice. Conversions
+    only touch the timer when one is given, so there is no cost when profiling is off.
+    """
+
+    STAGES = ("read", "parse", "group", "build", "encode", "write")
+
+    def __init__(self):
+        self.seconds: Dict[str, float] = dict.fromkeys(self.STAGES, 0.0)
+        self.counts: Dict[str, int] = {}
+        self.stage: Optional[str] = None
+        self.last = time.perf_counter()
+
+    def switch(self, stage: Optional[str]) -> Optional[str]:
+        """
+        Starts counting time towards `stage` (or nothing if `None`), and returns the previous stage
+        so that it can be switched back to.
+        """
+        now = time.perf_counter()
+        if self.stage is not None:
+            self.seconds[self.stage] += now - self.last
+        self.last = now
+        (previous, self.stage) = (self.stage, stage)
+        return previous
+
+    def timed(self, iterable: Iterable, stage: str, count: Optional[str] = None) -> Iterator:
+        """
+        Iterates over `iterable`, counting the time spent getting each item towards `stage`, and
+        the number of items towards `counts[count]` if given.
+        """
+        iterator = iter(iterable)
+        switch = self.switch
+        counts = self.counts
+
+        while True:
+            previous = switch(stage)
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                switch(previous)
+
+            if count is not None:
+                counts[count] = counts.get(count, 0) + 1
+
+            yield item
+
+    def print_report(self, file=None):
+        total = sum(self.seconds.values())
+
+        print(f"{'stage':<8} {'seconds':>9} {'%':>6}", file=file)
+        for stage in self.STAGES:
+            seconds = self.seconds[stage]
+            print(f"{stage:<8} {seconds:>9.4f} {100 * seconds / total if total else 0:>5.1f}%", file=file)
+        print(f"{'total':<8} {total:>9.4f}", file=file)
+
+        print(file=file)
+        for (name, count) in self.counts.items():
+            print(f"{name:<14} {count:>10}", file=file)
+
+        notes = self.counts.get("notes", 0)
+        if notes and total:
+            print(f"{'notes/second':<14} {notes / total:>10.0f}", file=file)
+
+
+def write_var_length(data: bytearray, value: int):
+    """
+    Appends `value` to `data` as a MIDI variable length quantity.
+    """
+    if value < 0x80:
+        data.append(value)
+        return
+
+    septets = [value & 0x7F]
+    value >>= 7
+    while value:
+        septets.append((value & 0x7F) | 0x80)
+        value >>= 7
+    data.extend(reversed(septets))
+
+
+def clamp_velocity(velocity: int) -> int:
+    if velocity < 0:
+        return 0
+    elif velocity > 127:
+        return 127
+    return velocity
+
+
+class PitchBendTable(dict):
+    """
+    Lookup table of cents offset to `(semitones, pitchbend)`, filled in the first time each cents
+    value is seen. A score only uses as many distinct cents offsets as its tuning has pitches,
+    so converting a note is a dictionary lookup instead of floating point maths.
+
+    `pitchbend` is the unsigned 14-bit pitch bend value (8192 is no bend), rounded to the nearest
+    step and clamped to 0-16383. If the offset is larger than the pitch bend range, whole
+    semitones are moved into `semitones`, to be added to the MIDI note number, so that the bend
+    always fits in the range. Use `note_and_bend` to apply them to a note.
+    """
+
+    def __init__(self, pitchbend_range: int):
+        super().__init__()
+        self.pitchbend_range = pitchbend_range
+
+    def __missing__(self, cents: float) -> Tuple[int, int]:
+        semitones = 0
+        bend_cents = cents
+
+        if abs(cents) > self.pitchbend_range * 100:
+            semitones = round(cents / 100)
+            bend_cents = cents - semitones * 100
+
+        pitchbend = self._pitchbend(bend_cents)
+
+        self[cents] = (semitones, pitchbend)
+        return (semitones, pitchbend)
+
+    def _pitchbend(self, cents: float) -> int:
+        pitchbend = round(cents / 100 / self.pitchbend_range * 8192) + 8192
+        return max(0, min(16383, pitchbend))
+
+    def note_and_bend(self, pitch: int, semitones: int, pitchbend: int, cents: float) -> Tuple[int, int]:
+        """
+        MIDI note number and pitch bend of a note, from its `(semitones, pitchbend)` entry.
+
+        If moving `semitones` into the note number would take it out of 0-127, only as many
+        semitones as fit are moved, and the rest is left to the (clamped) pitch bend.
+        """
+        note = pitch + semitones
+        if 0 <= note <= 127:
+            return (note, pitchbend)
+
+        note = max(0, min(127, note))
+        return (note, self._pitchbend(cents - (note - pitch) * 100))
+
+
+def conductor_track(tempos: List[Tuple[float, int]], first_tick: int) -> bytes:
+    """
+    Encodes the tempo map as the conductor track (the first track of a format 1 file), which
+    applies to all tracks.
+
+    `tempos` is a list of `(bpm, tick)` in any order. Tempo changes are sorted, only the last one is
+    kept when several are on the same tick, and changes to the tempo that is already set are
+    dropped.
+    """
+    # Set tempo meta event, in microseconds per quarter note.
+    microseconds = {}
+    for (bpm, tick) in tempos:
+        microseconds[tick] = int(60000000 / bpm)
+
+    track = bytearray()
+    last_tick = first_tick
+    last_microseconds = None
+
+    for tick in sorted(microseconds):
+        if microseconds[tick] == last_microseconds:
+            continue
+        last_microseconds = microseconds[tick]
+        write_var_length(track, max(tick - last_tick, 0))
+        track += b"\xFF\x51\x03" + struct.pack(">L", last_microseconds)[1:]
+        last_tick = max(tick, last_tick)
+
+    track += END_OF_TRACK
+
+    return b"MTrk" + struct.pack(">L", len(track)) + track
+
+
+class NoteStore:
+    """
+    Column-oriented storage of the notes of one staff, using one compact `array` per field
+    instead of one Python object per note (20 bytes per note instead of over 200).
+
+    Velocity clamping and pitch bend conversion are done over whole columns when the notes are
+    encoded.
+    """
+
+    def __init__(self):
+        self.starts = array('i')
+        self.pitches = array('h')
+        self.durations = array('i')
+        self.velocities = array('h')
+        self.cents = array('d')
+        self.is_sorted = True
+        """`True` if notes were appended in increasing start tick order."""
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def append(self, start: int, pitch: int, duration: int, velocity: int, cents: float):
+        if self.is_sorted and self.starts and start < self.starts[-1]:
+            self.is_sorted = False
+        self.starts.append(start)
+        self.pitches.append(pitch)
+        self.durations.append(duration)
+        self.velocities.append(velocity)
+        self.cents.append(cents)
+
+    def sorted_indices(self) -> Sequence[int]:
+        """
+        Indices of the notes in increasing start tick order. Notes that start on the same tick keep
+        the order they were added in.
+        """
+        if self.is_sorted:
+            return range(len(self.starts))
+        return sorted(range(len(self.starts)), key=self.starts.__getitem__)
+
+    def clamped_velocities(self) -> array:
+        return array('B', map(clamp_velocity, self.velocities))
+
+    def pitchbends(self, table: PitchBendTable) -> List[Tuple[int, int]]:
+        """
+        `(semitones, pitchbend)` of every note, see `PitchBendTable`.
+        """
+        return list(map(table.__getitem__, self.cents))
+
+
+class ChannelAllocator:
+    """
+    Assigns MPE member channels to notes, so that a channel's pitch bend is never changed while
+    one of its notes is still sounding.
+
+    Idle channels are kept in a heap ordered by the tick they were freed, so that the least
+    recently freed channel is picked first (giving the release tail of its last note the most
+    time to ring out). Busy channels are kept in a heap of release ticks. Each note costs
+    O(log n) heap operations.
+
+    An idle channel that is already bent to the note's pitch bend is preferred over the least
+    recently freed one, so that no pitch bend message has to be sent. Idle channels are also kept
+    in one heap per pitch bend for this.
+
+    When every channel is busy, the channel of the oldest sounding note is stolen if `steal` is
+    `True`, otherwise no channel is given out.
+    """
+
+    def __init__(self, channels: Sequence[int], steal: bool):
+        self.steal = steal
+
+        self.idle: List[Tuple[int, int]] = [(-1, channel) for channel in channels]
+        """Heap of `(freed tick, channel)`"""
+        heapq.heapify(self.idle)
+
+        self.idle_by_bend: Dict[int, List[Tuple[int, int]]] = {}
+        """Heaps of `(freed tick, channel)` of idle channels, by the channel's pitch bend."""
+
+        self.idle_since: Dict[int, int] = {channel: -1 for channel in channels}
+        """
+        Tick each channel was last freed. Idle heap entries of busy channels, or of an earlier
+        freed tick, are stale and are skipped when popped.
+        """
+
+        self.bends: Dict[int, Optional[int]] = {channel: None for channel in channels}
+        """Pitch bend of each channel, `None` if not sent yet."""
+
+        self.releases: List[Tuple[int, int, int]] = []
+        """Heap of `(release tick, note number, channel)` of busy channels."""
+
+        self.starts: List[Tuple[int, int, int]] = []
+        """Heap of `(start tick, note number, channel)` of busy channels, to find the oldest note."""
+
+        self.current: Dict[int, Optional[int]] = {channel: None for channel in channels}
+        """
+        Note number currently sounding on each channel, `None` if idle. Heap entries of other note
+        numbers are stale, and are skipped when popped.
+        """
+
+        self.count = 0
+
+    def allocate(self, start: int, end: int, pitchbend: Optional[int] = None
+                 ) -> Tuple[Optional[int], bool, bool]:
+        """
+        Finds a channel for a note from `start` to `end` with the given pitch bend. Notes must be
+        allocated in increasing `start` order.
+
+        Returns `(channel, stolen, bend_changed)`. `stolen` is `True` if the channel's previous note
+        is still sounding and has to be cut off. `bend_changed` is `True` if the channel's pitch
+        bend has to be set for this note. `channel` is `None` if there is no channel available and
+        stealing is disabled.
+        """
+        releases = self.releases
+        current = self.current
+
+        while releases and releases[0][0] <= start:
+            (release, number, channel) = heapq.heappop(releases)
+            if current[channel] == number:
+                current[channel] = None
+                self._add_idle(channel, release)
+
+        stolen = False
+        channel = None
+
+        if pitchbend in self.idle_by_bend:
+            channel = self._pop_idle(self.idle_by_bend[pitchbend])
+
+        if channel is None:
+            channel = self._pop_idle(self.idle)
+
+        if channel is None:
+            if not self.steal:
+                return (None, False, False)
+            while True:
+                (_, number, channel) = heapq.heappop(self.starts)
+                if current[channel] == number:
+                    break
+            stolen = True
+
+        number = self.count
+        self.count += 1
+        current[channel] = number
+        heapq.heappush(releases, (end, number, channel))
+
+        starts = self.starts
+        heapq.heappush(starts, (start, number, channel))
+        if len(starts) > 4 * len(current):
+            # Drop entries of notes that have already been released, so that this heap doesn't
+            # grow with the length of the score.
+            self.starts = [entry for entry in starts if current[entry[2]] == entry[1]]
+            heapq.heapify(self.starts)
+
+        bend_changed = self.bends[channel] != pitchbend
+        self.bends[channel] = pitchbend
+
+        return (channel, stolen, bend_changed)
+
+    def _is_idle(self, entry: Tuple[int, int]) -> bool:
+        (freed, channel) = entry
+        return self.current[channel] is None and self.idle_since[channel] == freed
+
+    def _add_idle(self, channel: int, freed: int):
+        self.idle_since[channel] = freed
+        entry = (freed, channel)
+
+        self.idle = self._push_idle(self.idle, entry)
+
+        bend = self.bends[channel]
+        if bend is not None:
+            self.idle_by_bend[bend] = self._push_idle(self.idle_by_bend.get(bend, []), entry)
+
+    def _push_idle(self, heap: List[Tuple[int, int]], entry: Tuple[int, int]) -> List[Tuple[int, int]]:
+        """
+        Pushes `entry` onto `heap`, and returns the heap to use from now on. A channel taken from
+        one idle heap leaves a stale entry in the other, so stale entries are dropped whenever the
+        heap gets longer than twice the number of channels.
+        """
+        heapq.heappush(heap, entry)
+        if len(heap) > 2 * len(self.current):
+            heap = [entry for entry in heap if self._is_idle(entry)]
+            heapq.heapify(heap)
+        return heap
+
+    def _pop_idle(self, heap: List[Tuple[int, int]]) -> Optional[int]:
+        while heap:
+            entry = heapq.heappop(heap)
+            if self._is_idle(entry):
+                return entry[1]
+        return None
+
+
+class TrackBuilder:
+    """
+    Builds the MPE track of a single staff, encoding MIDI events straight into a `bytearray`.
+
+    Notes are sent here one by one as they are read from the .mid.csv file. Events that can't be
+    written yet (note offs later than the current note) wait in a heap, so that events are always
+    encoded in time order.
+
+    If `stream` is `True`, each note is encoded as soon as it is added, and notes must be added in
+    increasing tick order. Otherwise, notes are kept until `finish()` and sorted first. Either way,
+    the encoded track is kept in `data` until `finish()`.
+
+    `overflow` decides what happens when all MPE channels are busy, see `OVERFLOW_POLICIES`.
+
+    `pitchbend_range` is the pitch bend range in semitones, sent at the start of the track.
+    """
+
+    def __init__(self, stream: bool = False, overflow: str = OVERFLOW_STEAL,
+                 pitchbend_range: int = PITCHBEND_RANGE):
+        self.stream = stream
+        self.overflow = overflow
+        self.pitchbend_range = pitchbend_range
+        self.pitchbends = PitchBendTable(pitchbend_range)
+        self.notes = NoteStore()
+        """Notes waiting to be sorted, only used when not streaming."""
+
+        self.pending: List[Tuple[int, int, int, bytes]] = []
+        """Heap of `(tick, order, insertion count, message)` waiting to be encoded."""
+        self.count = 0
+
+        self.cancelled = set()
+        """Insertion counts of pending events that must be skipped (their notes were cut off)."""
+
+        self.sounding: Dict[int, Tuple[int, int, Optional[int], int]] = {}
+        """
+        Channel to `(start, note on insertion count, pitch bend insertion count, pitch)` of the last
+        note on that channel. Its note off is the event right after its note on. The pitch bend
+        count is `None` if the note didn't change the channel's pitch bend.
+        """
+
+        self.allocator = ChannelAllocator(MPE_MEMBER_CHANNELS, overflow == OVERFLOW_STEAL)
+        self.spill: Optional[TrackBuilder] = None
+        """Extra track for notes that didn't fit in this track's channels."""
+
+        self.data = bytearray()
+        self.first_tick: Optional[int] = None
+        self.last_tick = 0
+        self.last_start = 0
+        """Start of the last note added when streaming, which the next note can't start before."""
+
+    def add_note(self, pitch: int, start: int, duration: int, velocity: int, cents: float):
+        if not self.stream:
+            self.notes.append(start, pitch, duration, velocity, cents)
+            return
+
+        # Channels are allocated in order of note starts, so an earlier note can't be added
+        # after a later one has been allocated.
+        if start < self.last_start:
+            raise ValueError(
+                f"Note at tick {start} comes after a note at tick {self.last_start}. "
+                "Notes must be sorted by tick to use --stream."
+            )
+        self.last_start = start
+
+        (semitones, pitchbend) = self.pitchbends[cents]
+        (note, pitchbend) = self.pitchbends.note_and_bend(pitch, semitones, pitchbend, cents)
+        self._add_note(note, start, duration, clamp_velocity(velocity), pitchbend)
+
+    def _add_note(self, pitch: int, start: int, duration: int, velocity: int, pitchbend: int):
+        """
+        Allocates a channel to the note and queues its events. `velocity` must already be clamped,
+        and `pitchbend` is the unsigned 14-bit pitch bend value (see `PitchBendTable`).
+        """
+        # Everything before this note can no longer be preceded by new events.
+        self._flush(start)
+
+        (channel, stolen, bend_changed) = self.allocator.allocate(start, start + duration, pitchbend)
+
+        if channel is None:
+            if self.spill is None:
+                self.spill = TrackBuilder(True, self.overflow, self.pitchbend_range)
+            self.spill._add_note(pitch, start, duration, velocity, pitchbend)
+            return
+
+        if stolen:
+            (stolen_start, note_on_count, bend_count, stolen_pitch) = self.sounding[channel]
+            self.cancelled.add(note_on_count + 1)
+            if stolen_start == start:
+                # The stolen note starts on this tick too, so it hasn't been encoded yet. A note off
+                # here would come before its note on, so the note is dropped instead.
+                self.cancelled.add(note_on_count)
+                if bend_changed and bend_count is not None:
+                    self.cancelled.add(bend_count)
+            else:
+                # Cut off the note that is still sounding on this channel before bending it.
+                self._push(start, ORDER_NOTE_OFF, bytes((0x80 | channel, stolen_pitch, 0)))
+
+        bend_count = None
+        if bend_changed:
+            bend_count = self.count
+            self._push(start, ORDER_PITCH_BEND, bytes((0xE0 | channel, pitchbend & 0x7F, pitchbend >> 7)))
+        self.sounding[channel] = (start, self.count, bend_count, pitch)
+        self._push(start, ORDER_NOTE_ON, bytes((0x90 | channel, pitch, velocity)))
+        self._push(start + duration, ORDER_NOTE_OFF, bytes((0x80 | channel, pitch, velocity)))
+
+    def finish(self, first_tick: int) -> List[bytes]:
+        """
+        Encodes all remaining events and returns the track chunk, followed by the chunks of spill
+        tracks if there were more simultaneous notes than MPE channels.
+
+        `first_tick` must be the earliest tick of the whole file. It is used as the origin of every
+        track, and the MPE configuration is sent there.
+        """
+        if not self.stream:
+            self.stream = True
+            notes = self.notes
+            starts = notes.starts
+            pitches = notes.pitches
+            durations = notes.durations
+            velocities = notes.clamped_velocities()
+            cents = notes.cents
+            note_and_bend = self.pitchbends.note_and_bend
+            pitchbends = notes.pitchbends(self.pitchbends)
+            for i in notes.sorted_indices():
+                (note, pitchbend) = note_and_bend(pitches[i], *pitchbends[i], cents[i])
+                self._add_note(note, starts[i], durations[i], velocities[i], pitchbend)
+            self.notes = NoteStore()
+
+        self._flush(None)
+
+        track = bytearray(b"\x00" + mpe_configuration(self.pitchbend_range))
+        if self.first_tick is not None:
+            write_var_length(track, self.first_tick - first_tick)
+            track += self.data
+        track += END_OF_TRACK
+
+        chunks = [b"MTrk" + struct.pack(">L", len(track)) + track]
+
+        if self.spill is not None:
+            chunks += self.spill.finish(first_tick)
+
+        return chunks
+
+    def cache_key(self, first_tick: int) -> str:
+        """
+        Hash of everything the encoded track depends on: the notes and options of this track, the
+        origin `first_tick`, and the source code of this script.
+
+        Only valid before `finish()` is called, and when not streaming.
+        """
+        key = hashlib.blake2b(_script_hash(), digest_size=20)
+        key.update(repr((first_tick, self.overflow, self.pitchbend_range)).encode())
+        notes = self.notes
+        for column in (notes.starts, notes.pitches, notes.durations, notes.velocities, notes.cents):
+            key.update(column)
+        return key.hexdigest()
+
+    def _push(self, tick: int, order: int, message: bytes):
+        if tick < self.last_tick:
+            raise ValueError(
+                f"Event at tick {tick} comes after tick {self.last_tick}. "
+                "Notes must be sorted by tick to use --stream."
+            )
+        heapq.heappush(self.pending, (tick, order, self.count, message))
+        self.count += 1
+
+    def _flush(self, before_tick: Optional[int]):
+        """
+        Encodes pending events earlier than `before_tick`, or all of them if `None`.
+        """
+        pending = self.pending
+        cancelled = self.cancelled
+        data = self.data
+
+        while pending and (before_tick is None or pending[0][0] < before_tick):
+            (tick, _, count, message) = heapq.heappop(pending)
+            if cancelled and count in cancelled:
+                cancelled.remove(count)
+                continue
+            if self.first_tick is None:
+                # The delta time of the first event is only known once the origin is known.
+                self.first_tick = tick
+            else:
+                write_var_length(data, tick - self.last_tick)
+            self.last_tick = tick
+            data += message
+
+
+class ProfiledTrackBuilder(TrackBuilder):
+    """
+    `TrackBuilder` that counts its time towards the "build" (allocating channels and queueing
+    events) and "encode" (writing queued events as bytes) stages of a `StageTimer`.
+
+    Only used with `--profile`, so that `TrackBuilder` itself has no timing overhead.
+    """
+
+    def __init__(self, timer: StageTimer, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timer = timer
+
+    def _add_note(self, *args):
+        previous = self.timer.switch("build")
+        super()._add_note(*args)
+        self.timer.switch(previous)
+
+    def finish(self, first_tick: int) -> List[bytes]:
+        previous = self.timer.switch("build")
+        chunks = super().finish(first_tick)
+        self.timer.switch(previous)
+        return chunks
+
+    def _flush(self, before_tick: Optional[int]):
+        previous = self.timer.switch("encode")
+        super()._flush(before_tick)
+        self.timer.switch(previous)
+
+
+@functools.lru_cache(maxsize=None)
+def _script_hash() -> bytes:
+    """
+    Hash of this script's source code, so that cached tracks are not reused after the encoder
+    changes.
+    """
+    with open(__file__, 'rb') as f:
+        return hashlib.blake2b(f.read(), digest_size=16).digest()
+
+
+def split_chunks(data: bytes) -> List[bytes]:
+    """
+    Splits concatenated MTrk chunks.
+    """
+    chunks = []
+    offset = 0
+    while offset < len(data):
+        (length,) = struct.unpack_from(">L", data, offset + 4)
+        chunks.append(data[offset:offset + 8 + length])
+        offset += 8 + length
+    return chunks
+
+
+def read_track_cache(cache_dir: str, key: str) -> Optional[List[bytes]]:
+    """
+    Returns the cached track chunks (see `TrackBuilder.finish`) of the given cache key, or `None`
+    if they aren't cached.
+    """
+    try:
+        with open(os.path.join(cache_dir, key + ".trk"), 'rb') as f:
+            return split_chunks(f.read())
+    except OSError:
+        return None
+
+
+def update_track_cache(cache_dir: str, tracks: Dict[str, List[bytes]]):
+    """
+    Writes track chunks by cache key, and removes cached tracks that are no longer used.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+
+    for filename in os.listdir(cache_dir):
+        if filename.endswith(".trk") and filename[:-len(".trk")] not in tracks:
+            os.remove(os.path.join(cache_dir, filename))
+
+    for (key, chunks) in tracks.items():
+        path = os.path.join(cache_dir, key + ".trk")
+        if not os.path.exists(path):
+            with open(path + ".tmp", 'wb') as f:
+                f.write(b"".join(chunks))
+            os.replace(path + ".tmp", path)
+
+
+def _finish_track(builder: TrackBuilder, first_tick: int) -> List[bytes]:
+    """
+    Process pool worker: encodes a staff's track in a separate process.
+    """
+    return builder.finish(first_tick)
+
+
+class Staves:
+    """
+    The notes of a .mid.csv file, read into one `TrackBuilder` per staff, with the tempo map.
+    """
+
+    def __init__(self, rows: Iterator[Row], stream: bool = False, overflow: str = OVERFLOW_STEAL,
+                 pitchbend_range: int = PITCHBEND_RANGE, timer: Optional[StageTimer] = None):
+        self.builders: Dict[int, TrackBuilder] = {}
+        self.tempos: List[Tuple[float, int]] = []
+        self.stream = stream
+
+        self.first_tick = 1e9
+        """The earliest tick of any note or tempo change. Delta times of all tracks start here."""
+
+        builders = self.builders
+        first_tick = self.first_tick
+
+        if timer is None:
+            new_builder = TrackBuilder
+        else:
+            new_builder = functools.partial(ProfiledTrackBuilder, timer)
+            previous_stage = timer.switch("group")
+
+        for (staff, pitch, tick, duration, velocity, cents) in rows:
             if tick < first_tick:
                 first_tick = tick
-                
-            if staff == -2:
-                # Tempo signal
-                # row[1] is bpm, row[2] is tick.
-                tempos.append([float(row[1]), tick])
+
+            if staff == TEMPO_STAFF:
+                self.tempos.append((pitch, tick))
                 continue
-            
-            if staff_notes.get(staff) is None:
-                staff_notes[staff] = []
-            
-            staff_notes[staff].append([int(float(row[1])), tick, int(float(row[3])), int(float(row[4])), float(row[5])])
-        
-        if max_staff == -1:
-            print("No notes found. Not exporting anything.")
-            quit()
-        
-        mpe = midiutil.MIDIFile(
-            max_staff + 1, 
-            file_format=2, # use format 2 (corresponds to midi type 1, separate tracks in one file)
-            ticks_per_quarternote=ticks_per_quarter, 
-            eventtime_is_ticks=True,
-            adjust_origin=True)
-        
-        
-        for (track, notes) in staff_notes.items():
-            # Send MPE configuration RPN (MSB 00, LSB 06)
-            # upper zone mpe (send on channel 15 to use 0-14 as the zone)
-            # Data MSB: 0xF (assigns 15 channels to zone)
-            # Data LSB is ignored. Set to None.
-            # Time order = True
-            mpe.makeRPNCall(track, 15, first_tick, 0x00, 0x06, 0x0F, None, True)
-            channel = 1 # round robin, channels 0-14 (15 is reserved for MPE zone messages)
-            
-            # send tempo changes
-            for t in tempos:
-                mpe.addTempo(track, t[1], t[0])
-            
-            for [pitch, start, duration, velocity, cents] in notes:
-                if velocity < 0:
-                    velocity = 0
-                elif velocity > 127:
-                    velocity = 127
-                
-                mpe.addNote(track, channel, pitch, start, duration, velocity)
-                
-                pitchbend = int(cents / 100 / PITCHBEND_RANGE * 8192)
-                mpe.addPitchWheelEvent(track, channel, start, pitchbend)
-                
-                channel += 1
-                
-                if channel > 15:
-                    channel = 1
-        
-        export_path = args.filepath.replace(".mid.csv", ".mid")
-        
-        print(f'Exporting to "{export_path}"...')
-        
-        try:
-            with open(export_path, "wb") as outfile:
-                mpe.writeFile(outfile)
-            print('Done!')
-        except Exception as e:
-            print(f"ERROR: Could not write file: {e}")
-            exit()
-except FileNotFoundError:
-    print("ERROR: File not found.")
-    exit()
+
+            builder = builders.get(staff)
+            if builder is None:
+                builder = builders[staff] = new_builder(stream, overflow, pitchbend_range)
+
+            try:
+                builder.add_note(pitch, tick, duration, velocity, cents)
+            except ValueError as e:
+                raise ValueError(f"Staff {staff + 1}: {e}") from None
+
+        self.first_tick = first_tick
+
+        if timer is not None:
+            timer.switch(previous_stage)
+            timer.counts["tempo changes"] = len(self.tempos)
+            timer.counts["notes"] = timer.counts.get("rows", 0) - len(self.tempos)
+            timer.counts["staves"] = len(builders)
+
+    def conductor_track(self) -> bytes:
+        return conductor_track(self.tempos, self.first_tick)
+
+    def encode(self, jobs: int = 1, cache_dir: Optional[str] = None) -> Iterator[Tuple[int, List[bytes]]]:
+        """
+        Encodes the track of every staff, and yields `(staff, chunks)` as each one is done, in no
+        particular order. `chunks` is the staff's track followed by its spill tracks, if any.
+
+        If `jobs` is more than 1, the tracks are encoded in parallel on a pool of that many
+        processes.
+
+        If `cache_dir` is given, encoded tracks are stored there by `TrackBuilder.cache_key`, and
+        staves that haven't changed since the last conversion are copied from the cache instead of
+        being encoded again. Not used when streaming.
+
+        When profiling with more than 1 job, only the time spent waiting for the pool is measured,
+        as "encode".
+        """
+        if self.stream:
+            cache_dir = None
+
+        first_tick = self.first_tick
+        tracks: Dict[int, List[bytes]] = {}
+        cache_keys: Dict[int, str] = {}
+
+        if cache_dir is not None:
+            for (staff, builder) in self.builders.items():
+                cache_keys[staff] = builder.cache_key(first_tick)
+                cached = read_track_cache(cache_dir, cache_keys[staff])
+                if cached is not None:
+                    tracks[staff] = cached
+                    yield (staff, cached)
+
+        todo = {staff: builder for (staff, builder) in self.builders.items() if staff not in tracks}
+
+        if jobs > 1 and len(todo) > 1:
+            with concurrent.futures.ProcessPoolExecutor(min(jobs, len(todo))) as executor:
+                # Submit the largest staves first so that they don't end up running last.
+                futures = {
+                    executor.submit(_finish_track, builder, first_tick): staff
+                    for (staff, builder)
+                    in sorted(todo.items(), key=lambda item: len(item[1].notes), reverse=True)
+                }
+                for future in concurrent.futures.as_completed(futures):
+                    staff = futures[future]
+                    tracks[staff] = future.result()
+                    yield (staff, tracks[staff])
+        else:
+            for (staff, builder) in todo.items():
+                tracks[staff] = builder.finish(first_tick)
+                yield (staff, tracks[staff])
+
+        if cache_dir is not None:
+            update_track_cache(cache_dir, {cache_keys[staff]: tracks[staff] for staff in self.builders})
+
+
+def midi_header(num_tracks: int, ticks_per_quarter: int) -> bytes:
+    """
+    SMF header chunk, format 1 (simultaneous tracks).
+    """
+    return b"MThd" + struct.pack(">LHHH", 6, 1, num_tracks, ticks_per_quarter)
+
+
+def convert(
+    rows: Iterator[Row], ticks_per_quarter: int, stream: bool = False, jobs: int = 1,
+    overflow: str = OVERFLOW_STEAL, pitchbend_range: int = PITCHBEND_RANGE,
+    cache_dir: Optional[str] = None, timer: Optional[StageTimer] = None
+) -> Optional[bytes]:
+    """
+    Streams parsed .mid.csv rows into one `TrackBuilder` per staff, and returns the bytes of the
+    resulting .mid file, or `None` if there are no notes.
+
+    See `Staves.encode` for `jobs` and `cache_dir`. Tracks are independent, so they can be joined
+    in staff order afterwards.
+
+    The first track is the conductor track, which holds the tempo map. Staff n is track n + 1.
+    Spill tracks (see `OVERFLOW_SPILL`) come after the last staff.
+
+    If `timer` is given, the time taken by each stage is counted there (see `StageTimer`).
+    """
+    staves = Staves(rows, stream, overflow, pitchbend_range, timer)
+
+    if not staves.builders:
+        return None
+
+    if timer is not None:
+        previous_stage = timer.switch("encode")
+
+    tracks = dict(staves.encode(jobs, cache_dir))
+
+    chunks = [staves.conductor_track()]
+    spill_chunks = []
+
+    for staff in range(max(tracks) + 1):
+        (chunk, *spills) = tracks.get(staff, [EMPTY_TRACK])
+        chunks.append(chunk)
+        spill_chunks += spills
+
+    chunks += spill_chunks
+
+    midi_bytes = midi_header(len(chunks), ticks_per_quarter) + b"".join(chunks)
+
+    if timer is not None:
+        timer.switch(previous_stage)
+        timer.counts["tracks"] = len(chunks)
+        timer.counts["bytes"] = len(midi_bytes)
+
+    return midi_bytes
+
+
+@contextlib.contextmanager
+def open_replacing(path: str, buffering: int = -1) -> Iterator[BinaryIO]:
+    """
+    Opens a temporary file next to `path` for writing, and moves it over `path` once written, so
+    that `path` is never left half-written (or truncated while it is still being read).
+    """
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "wb", buffering=buffering) as f:
+            yield f
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def check_not_input(filepath: str, export_path: str):
+    """
+    Raises `ValueError` if `export_path` is the input file itself.
+    """
+    if filepath != STDIO_PATH and export_path != STDIO_PATH and (
+        os.path.abspath(filepath) == os.path.abspath(export_path)
+        or (os.path.exists(filepath) and os.path.exists(export_path)
+            and os.path.samefile(filepath, export_path))
+    ):
+        raise ValueError(f'The output file "{export_path}" is the input file.')
+
+
+def _write_part(path: str, header: bytes, conductor: bytes, chunks: List[bytes]):
+    """
+    Thread pool worker: writes the .mid file of one staff.
+    """
+    with open_replacing(path, PART_WRITE_BUFFER_SIZE) as f:
+        f.write(header)
+        f.write(conductor)
+        f.writelines(chunks)
+
+
+def convert_parts(
+    rows: Iterator[Row], ticks_per_quarter: int, export_path: str, stream: bool = False,
+    jobs: int = 1, overflow: str = OVERFLOW_STEAL, pitchbend_range: int = PITCHBEND_RANGE,
+    cache_dir: Optional[str] = None, timer: Optional[StageTimer] = None
+) -> List[str]:
+    """
+    Like `convert`, but writes one .mid file per staff (see `part_path_of`), each with its own
+    copy of the conductor track followed by the staff's track and its spill tracks.
+
+    Each file is written on a thread pool as soon as its track is encoded, so disk writes overlap
+    the encoding of the remaining staves.
+
+    Returns the paths of the written files in staff order, or an empty list if there are no notes.
+
+    If `timer` is given, writes that overlap encoding aren't measured, only the time spent waiting
+    for the remaining writes at the end.
+    """
+    staves = Staves(rows, stream, overflow, pitchbend_range, timer)
+
+    if not staves.builders:
+        return []
+
+    if timer is not None:
+        previous_stage = timer.switch("encode")
+
+    conductor = staves.conductor_track()
+    paths = {}
+
+    with concurrent.futures.ThreadPoolExecutor(max(jobs, 1)) as writer:
+        futures = []
+        for (staff, chunks) in staves.encode(jobs, cache_dir):
+            paths[staff] = part_path_of(export_path, staff)
+            header = midi_header(1 + len(chunks), ticks_per_quarter)
+            futures.append(writer.submit(_write_part, paths[staff], header, conductor, chunks))
+
+        if timer is not None:
+            timer.switch("write")
+
+        # Raise write errors, if any.
+        for future in futures:
+            future.result()
+
+    if timer is not None:
+        timer.switch(previous_stage)
+        timer.counts["files"] = len(paths)
+
+    return [paths[staff] for staff in sorted(paths)]
+
+
+def export_path_of(filepath: str, to_bin: bool = False) -> str:
+    """
+    Path of the .mid file (or .mid.bin file if `to_bin`) generated from the given .mid.csv or
+    .mid.bin file.
+    """
+    for extension in (CSV_EXTENSION, BIN_EXTENSION):
+        if filepath.endswith(extension):
+            filepath = filepath[:-len(extension)]
+            break
+
+    return filepath + (BIN_EXTENSION if to_bin else ".mid")
+
+
+def part_path_of(export_path: str, staff: int) -> str:
+    """
+    Path of the .mid file of one staff when writing one file per staff, e.g. `score.staff1.mid`
+    for the first staff of `score.mid`. Staves are numbered from 1, as in MuseScore.
+    """
+    if export_path.endswith(".mid"):
+        export_path = export_path[:-len(".mid")]
+
+    return f"{export_path}.staff{staff + 1}.mid"
+
+
+def find_inputs(patterns: List[str], to_bin: bool = False) -> List[str]:
+    """
+    Expands directories (searched recursively) and glob patterns into the .mid.csv and .mid.bin
+    files they contain. Plain paths are kept as they are, even if they don't exist, so that they
+    are reported as not found.
+
+    When a directory or glob finds both the .mid.csv and the .mid.bin of the same export, only the
+    .mid.bin is used if it is up to date. If `to_bin`, directories and globs only find .mid.csv
+    files, as .mid.bin files are what is being written.
+    """
+    filepaths = []
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            found = glob.glob(os.path.join(glob.escape(pattern), "**", "*.mid.*"), recursive=True)
+        elif glob.has_magic(pattern):
+            found = glob.glob(pattern, recursive=True)
+        else:
+            filepaths.append(pattern)
+            continue
+
+        found = set(path for path in found if path.endswith(CSV_EXTENSION) or path.endswith(BIN_EXTENSION))
+
+        for path in sorted(found):
+            if to_bin and path.endswith(BIN_EXTENSION):
+                continue
+
+            if path.endswith(CSV_EXTENSION):
+                (csv_path, bin_path) = (path, export_path_of(path, True))
+            else:
+                (csv_path, bin_path) = (path[:-len(BIN_EXTENSION)] + CSV_EXTENSION, path)
+
+            if not to_bin and csv_path in found and bin_path in found:
+                use_bin = is_up_to_date(csv_path, bin_path)
+                if use_bin != (path == bin_path):
+                    continue
+
+            filepaths.append(path)
+
+    # Remove duplicates from overlapping patterns, keeping the order.
+    return list(dict.fromkeys(filepaths))
+
+
+def is_up_to_date(filepath: str, export_path: str) -> bool:
+    try:
+        return os.path.getmtime(export_path) > os.path.getmtime(filepath)
+    except OSError:
+        return False
+
+
+def are_parts_up_to_date(filepath: str, export_path: str) -> bool:
+    """
+    Like `is_up_to_date`, for the per-staff files written by `convert_parts`: true if there is at
+    least one part file of `export_path`, and every one is newer than `filepath`.
+    """
+    prefix = part_path_of(export_path, 0)[:-len("1.mid")]
+    parts = [
+        path for path in glob.glob(glob.escape(prefix) + "*.mid")
+        if path[len(prefix):-len(".mid")].isdigit()
+    ]
+    return bool(parts) and all(is_up_to_date(filepath, path) for path in parts)
+
+
+def convert_file(filepath: str, to_bin: bool = False, cache: bool = False, split: bool = False,
+                 **convert_options) -> Optional[str]:
+    """
+    Converts a .mid.csv or .mid.bin file and writes the .mid file next to it. If `to_bin` is
+    `True`, writes the rows to a .mid.bin file instead.
+
+    If `cache` is `True`, encoded tracks are cached in a .mid.cache folder next to the .mid file.
+
+    If `split` is `True`, writes one .mid file per staff with `convert_parts`.
+
+    `convert_options` are passed on to `convert`.
+
+    Returns the path of the written file (of the first staff if `split`), or `None` if there are
+    no notes.
+    """
+    export_path = export_path_of(filepath, to_bin)
+    check_not_input(filepath, export_path)
+
+    if to_bin:
+        with open_mid_rows(filepath) as (ticks_per_quarter, rows):
+            with open_replacing(export_path) as outfile:
+                write_mid_bin(rows, ticks_per_quarter, outfile)
+        return export_path
+
+    cache_dir = export_path + CACHE_EXTENSION if cache else None
+
+    if split:
+        with open_mid_rows(filepath) as (ticks_per_quarter, rows):
+            paths = convert_parts(rows, ticks_per_quarter, export_path, cache_dir=cache_dir,
+                                  **convert_options)
+        return paths[0] if paths else None
+
+    with open_mid_rows(filepath) as (ticks_per_quarter, rows):
+        midi_bytes = convert(rows, ticks_per_quarter, cache_dir=cache_dir, **convert_options)
+
+    if midi_bytes is None:
+        return None
+
+    with open_replacing(export_path) as outfile:
+        outfile.write(midi_bytes)
+
+    return export_path
+
+
+def _convert_file_timed(filepath: str, to_bin: bool, cache: bool,
+                        convert_options: dict) -> Tuple[str, float]:
+    """
+    Batch worker: converts one file, returning a status message and how long it took.
+    """
+    start_time = time.perf_counter()
+
+    try:
+        if convert_file(filepath, to_bin, cache, **convert_options) is None:
+            status = "no notes"
+        else:
+            status = "done"
+    except FileNotFoundError:
+        status = "ERROR: File not found."
+    except ValueError as e:
+        status = f"ERROR: {e}"
+    except OSError as e:
+        status = f"ERROR: Could not write file: {e}"
+    except Exception as e:
+        # Any other failure only fails this file, not the whole batch.
+        status = f"ERROR: {type(e).__name__}: {e}"
+
+    return (status, time.perf_counter() - start_time)
+
+
+def convert_batch(filepaths: List[str], jobs: int, force: bool, to_bin: bool, cache: bool,
+                  convert_options: dict):
+    """
+    Converts many files on a pool of `jobs` processes, skipping files whose output is newer
+    (unless `force`), then prints a summary with the time taken for each file.
+    """
+    start_time = time.perf_counter()
+
+    results: Dict[str, Tuple[str, float]] = {}
+    todo = []
+
+    for filepath in filepaths:
+        export_path = export_path_of(filepath, to_bin)
+        if convert_options.get("split") and not to_bin:
+            up_to_date = are_parts_up_to_date(filepath, export_path)
+        else:
+            up_to_date = is_up_to_date(filepath, export_path)
+
+        if not force and up_to_date:
+            results[filepath] = ("skipped (up to date)", 0.0)
+        else:
+            todo.append(filepath)
+
+    print(f"Converting {len(todo)} of {len(filepaths)} files...")
+
+    if jobs > 1 and len(todo) > 1:
+        with concurrent.futures.ProcessPoolExecutor(min(jobs, len(todo))) as executor:
+            futures = {
+                filepath: executor.submit(_convert_file_timed, filepath, to_bin, cache, convert_options)
+                for filepath in todo
+            }
+            for (filepath, future) in futures.items():
+                results[filepath] = future.result()
+    else:
+        for filepath in todo:
+            results[filepath] = _convert_file_timed(filepath, to_bin, cache, convert_options)
+
+    print()
+    for filepath in filepaths:
+        (status, seconds) = results[filepath]
+        print(f"{seconds:8.3f}s  {status:<22} {filepath}")
+
+    converted = sum(1 for (status, _) in results.values() if status == "done")
+    failed = sum(1 for (status, _) in results.values() if status.startswith("ERROR"))
+
+    print(
+        f"\nConverted {converted} files ({len(filepaths) - len(todo)} skipped, {failed} failed) "
+        f"in {time.perf_counter() - start_time:.3f}s"
+    )
+
+
+def main():
+    argparser = argparse.ArgumentParser("generate-mpe")
+    argparser.add_argument(
+        "filepath", nargs="+",
+        help="Path to the .mid.csv (or .mid.bin) file, or - to read from stdin. Multiple files, "
+        "directories (searched recursively) and glob patterns can be given to convert many files "
+        "at once.")
+    argparser.add_argument(
+        "-o", "--output", metavar="PATH",
+        help="Path of the output file, or - to write to stdout. (default: next to the input file, "
+        "or stdout when reading from stdin)")
+    argparser.add_argument(
+        "--split", action="store_true",
+        help="Write one .mid file per staff (score.staff1.mid, score.staff2.mid, ...) instead of "
+        "one file with a track per staff.")
+    argparser.add_argument(
+        "--stream", action="store_true",
+        help="Encode notes as they are read. The notes of each staff must be sorted by tick.")
+    argparser.add_argument(
+        "-j", "--jobs", type=int, default=1,
+        help="Number of processes used to encode staves in parallel, or files in parallel when "
+        "converting many files. 0 uses all CPUs. (default: 1)")
+    argparser.add_argument(
+        "--overflow", choices=OVERFLOW_POLICIES, default=OVERFLOW_STEAL,
+        help="What to do when a staff has more than 15 notes sounding at once: steal the channel "
+        "of the oldest note, or spill the note into an extra track. (default: steal)")
+    argparser.add_argument(
+        "--pitchbend-range", type=int, default=PITCHBEND_RANGE, metavar="SEMITONES",
+        help="Pitch bend range of your synth in semitones. Sent to the synth at the start of each "
+        f"track. (default: {PITCHBEND_RANGE})")
+    argparser.add_argument(
+        "--cache", action="store_true",
+        help="Keep the encoded tracks in a .mid.cache folder next to the .mid file, and only "
+        "re-encode the staves that changed since the last export.")
+    argparser.add_argument(
+        "--profile", nargs="?", const=True, metavar="PSTATS_PATH",
+        help="Print how long each stage of the conversion took (read, parse, group, build, encode, "
+        "write) with row, note and tempo change counts. If a path is given, save a cProfile of the "
+        "conversion there instead, to be viewed with pstats.")
+    argparser.add_argument(
+        "--force", action="store_true",
+        help="When converting many files, also convert files whose output file is up to date.")
+    argparser.add_argument(
+        "--to-bin", action="store_true",
+        help="Convert .mid.csv files to the binary .mid.bin format instead of creating .mid files. "
+        ".mid.bin files are much faster to read, and can be given to this script like .mid.csv files.")
+    args = argparser.parse_args()
+
+    if args.jobs == 0:
+        args.jobs = os.cpu_count() or 1
+
+    if not 1 <= args.pitchbend_range <= 96:
+        argparser.error("--pitchbend-range must be between 1 and 96 semitones.")
+
+    convert_options = {
+        "stream": args.stream,
+        "overflow": args.overflow,
+        "pitchbend_range": args.pitchbend_range,
+    }
+
+    filepaths = find_inputs(args.filepath, args.to_bin)
+
+    if len(filepaths) != 1 or filepaths[0] != args.filepath[0]:
+        if STDIO_PATH in filepaths:
+            argparser.error("Reading from stdin (-) can't be combined with other inputs.")
+        if args.output is not None:
+            argparser.error("--output can only be used when converting a single file.")
+        if args.profile is not None:
+            argparser.error("--profile can only be used when converting a single file.")
+        convert_batch(filepaths, args.jobs, args.force, args.to_bin, args.cache,
+                      {**convert_options, "split": args.split})
+        return
+
+    if args.stream and args.jobs > 1:
+        argparser.error("--stream encodes notes while reading, it can't be used with --jobs.")
+
+    if args.stream and args.cache:
+        argparser.error("--stream encodes notes while reading, it can't be used with --cache.")
+
+    filepath = filepaths[0]
+
+    if args.output is not None:
+        export_path = args.output
+    elif filepath == STDIO_PATH:
+        export_path = STDIO_PATH
+    else:
+        export_path = export_path_of(filepath, args.to_bin)
+
+    to_stdout = export_path == STDIO_PATH
+
+    try:
+        check_not_input(filepath, export_path)
+    except ValueError as e:
+        argparser.error(str(e))
+
+    if to_stdout and args.cache:
+        argparser.error("--cache needs an output file, it can't be used when writing to stdout.")
+
+    if to_stdout and args.split:
+        argparser.error("--split writes several files, it can't be used when writing to stdout.")
+
+    # Keep stdout clean for the .mid data when piping.
+    log = functools.partial(print, file=sys.stderr) if to_stdout else print
+    target = "stdout" if to_stdout else f'"{export_path}"'
+
+    def open_output():
+        if to_stdout:
+            return contextlib.nullcontext(sys.stdout.buffer)
+        return open_replacing(export_path)
+
+    timer = StageTimer() if args.profile is True else None
+    profiler = cProfile.Profile() if isinstance(args.profile, str) else None
+
+    if timer is not None:
+        timer.switch("read")
+    if profiler is not None:
+        profiler.enable()
+
+    try:
+        export(
+            filepath, export_path, args, convert_options, timer, log, target, open_output)
+    finally:
+        if timer is not None:
+            timer.switch(None)
+            log()
+            timer.print_report(sys.stderr if to_stdout else None)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+            log(f'Saved profile to "{args.profile}"')
+
+
+def export(filepath: str, export_path: str, args: argparse.Namespace, convert_options: dict,
+           timer: Optional[StageTimer], log, target: str, open_output):
+    """
+    Converts a single file for `main()`, printing progress messages with `log`.
+    """
+    if args.to_bin:
+        log(f'Exporting to {target}...')
+
+    try:
+        with open_mid_rows(filepath, timer) as (ticks_per_quarter, rows):
+            if args.to_bin:
+                if timer is not None:
+                    timer.switch("write")
+                with open_output() as outfile:
+                    write_mid_bin(rows, ticks_per_quarter, outfile)
+                log('Done!')
+                return
+
+            cache_dir = export_path + CACHE_EXTENSION if args.cache else None
+
+            if args.split:
+                paths = convert_parts(rows, ticks_per_quarter, export_path, jobs=args.jobs,
+                                      cache_dir=cache_dir, timer=timer, **convert_options)
+                for path in paths:
+                    log(f'Exported "{path}"')
+                log('Done!' if paths else "No notes found. Not exporting anything.")
+                return
+
+            midi_bytes = convert(
+                rows, ticks_per_quarter, jobs=args.jobs, cache_dir=cache_dir, timer=timer,
+                **convert_options)
+    except FileNotFoundError:
+        log("ERROR: File not found.")
+        exit()
+    except ValueError as e:
+        log(f"ERROR: {e}")
+        exit()
+    except OSError as e:
+        log(f"ERROR: Could not write file: {e}")
+        exit()
+
+    if midi_bytes is None:
+        log("No notes found. Not exporting anything.")
+        quit()
+
+    log(f'Exporting to {target}...')
+
+    if timer is not None:
+        timer.switch("write")
+
+    try:
+        with open_output() as outfile:
+            outfile.write(midi_bytes)
+            outfile.flush()
+        log('Done!')
+    except Exception as e:
+        log(f"ERROR: Could not write file: {e}")
+        exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,389 @@
+# Copyright (C) 2023 euwbah
+#
+# This file is part of Xen Tuner.
+#
+# Xen Tuner is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Xen Tuner is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Xen Tuner.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Benchmarks generate-mpe.py on synthetic .mid.csv files.
+
+How to use (from the project root):
+
+`python3 scripts/benchmark-mpe.py --staves 1 8 32 --notes 10000 100000 --output bench.json`
+
+Every combination of `--staves` and `--notes` (notes per staff) is one case. Each case runs in a
+fresh process so that its peak RSS can be measured, and is repeated `--repeat` times, keeping the
+fastest time of each stage. Like a real conversion, the rows are never all held in memory at once,
+so peak RSS is that of the converter:
+
+- parse: reading and parsing the .mid.csv rows, without keeping them.
+- group: sorting the rows into one track builder per staff. The rows are parsed again as they are
+  grouped, like `convert()` does, and the parse time is subtracted.
+- allocate: assigning MPE channels to every note (on its own, for comparison).
+- encode: encoding every track, including channel allocation.
+- write: joining the tracks into the .mid file and writing it.
+
+Every run also checks that each note on of the encoded tracks has a matching note off, and that no
+channel is bent while one of its notes is sounding.
+
+Results are printed as a table, and saved as JSON with `--output` so that they can be compared
+between versions.
+
+To only write a synthetic score, use `--generate path/to/score.mid.csv`.
+"""
+
+import argparse
+import collections
+import importlib.util
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows.
+    resource = None
+
+GENERATE_MPE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "generate-mpe.py")
+
+STAGES = ["parse", "group", "allocate", "encode", "write"]
+
+TICKS_PER_QUARTER = 480
+DURATIONS = [120, 240, 480, 960]
+
+
+def generate_score(path: str, staves: int, notes_per_staff: int, tempo_changes: int = 10,
+                   chord_size: float = 2.0, cents_spread: float = 50.0, cents_values: int = 31,
+                   seed: int = 0):
+    """
+    Writes a random .mid.csv file in the same layout as the Export MIDI CSV plugin: rows are written
+    staff by staff, and tempo changes are written along with the first staff.
+
+    Chords have 1 to `2 * chord_size - 1` notes (`chord_size` on average). Cents offsets are picked
+    from `cents_values` distinct values in `±cents_spread`, like a tuning with that many pitches
+    per octave would have.
+    """
+    rng = random.Random(seed)
+
+    cents_choices = [rng.uniform(-cents_spread, cents_spread) for _ in range(cents_values)]
+    max_chord_size = max(1, round(2 * chord_size - 1))
+
+    with open(path, "w") as f:
+        f.write(f"{TICKS_PER_QUARTER}\n")
+
+        for staff in range(staves):
+            tick = 0
+            written = 0
+
+            while written < notes_per_staff:
+                duration = rng.choice(DURATIONS)
+                size = min(rng.randint(1, max_chord_size), notes_per_staff - written)
+
+                for pitch in rng.sample(range(36, 97), size):
+                    f.write(
+                        f"{staff}, {pitch}, {tick}, {duration}, {rng.randint(40, 110)}, "
+                        f"{rng.choice(cents_choices)}\n"
+                    )
+
+                written += size
+                tick += duration
+
+            if staff == 0:
+                for i in range(tempo_changes):
+                    f.write(f"-2, {rng.uniform(60, 160)}, {tick * i // max(tempo_changes, 1)}\n")
+
+
+def load_generate_mpe():
+    """
+    Imports generate-mpe.py (which can't be imported by name because of the hyphen).
+    """
+    spec = importlib.util.spec_from_file_location("generate_mpe", GENERATE_MPE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    # Registered so that the process pool used by --jobs can pickle its classes.
+    sys.modules["generate_mpe"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def read_var_length(data: bytes, offset: int):
+    value = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value = (value << 7) | (byte & 0x7F)
+        if byte < 0x80:
+            return value, offset
+
+
+def check_track(chunk: bytes) -> List[str]:
+    """
+    Returns the problems in the notes of an encoded MTrk chunk: note ons of a note that is already
+    sounding, note offs of a note that isn't, pitch bends of a channel while one of its notes is
+    sounding, and notes that never end.
+    """
+    problems = []
+    sounding: Dict[int, set] = {}
+    offset = 8
+    tick = 0
+    status = 0
+
+    while offset < len(chunk):
+        (delta, offset) = read_var_length(chunk, offset)
+        tick += delta
+
+        if chunk[offset] & 0x80:
+            status = chunk[offset]
+            offset += 1
+
+        if status == 0xFF:
+            (length, offset) = read_var_length(chunk, offset + 1)
+            offset += length
+            continue
+        if status in (0xF0, 0xF7):
+            (length, offset) = read_var_length(chunk, offset)
+            offset += length
+            continue
+
+        (kind, channel) = (status & 0xF0, status & 0x0F)
+        data = chunk[offset:offset + (1 if kind in (0xC0, 0xD0) else 2)]
+        offset += len(data)
+        notes = sounding.setdefault(channel, set())
+
+        if kind == 0x90 and data[1] > 0:
+            if data[0] in notes:
+                problems.append(f"tick {tick}: note on of sounding note {data[0]} on channel {channel}")
+            notes.add(data[0])
+        elif kind in (0x80, 0x90):
+            if data[0] not in notes:
+                problems.append(f"tick {tick}: note off of silent note {data[0]} on channel {channel}")
+            notes.discard(data[0])
+        elif kind == 0xE0 and notes:
+            problems.append(f"tick {tick}: pitch bend of channel {channel} while {sorted(notes)} sound")
+
+    for (channel, notes) in sounding.items():
+        problems += [f"note {note} on channel {channel} never ends" for note in sorted(notes)]
+
+    return problems
+
+
+def peak_rss_bytes() -> Optional[int]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS.
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_case(path: str, repeat: int) -> dict:
+    """
+    Times each stage of converting the .mid.csv file at `path`, in this process.
+    """
+    mpe = load_generate_mpe()
+
+    best: Dict[str, float] = {stage: float("inf") for stage in STAGES}
+    num_notes = 0
+    num_tempos = 0
+    output_size = 0
+
+    for _ in range(repeat):
+        times = {}
+
+        start = time.perf_counter()
+        with open(path) as f:
+            (ticks_per_quarter, rows) = mpe.read_mid_csv(f)
+            collections.deque(rows, maxlen=0)
+        times["parse"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with open(path) as f:
+            (ticks_per_quarter, rows) = mpe.read_mid_csv(f)
+            staves = mpe.Staves(rows)
+        times["group"] = max(time.perf_counter() - start - times["parse"], 0.0)
+
+        # Counted before encoding, which frees the buffered notes.
+        num_notes = sum(len(builder.notes) for builder in staves.builders.values())
+        num_tempos = len(staves.tempos)
+
+        start = time.perf_counter()
+        for builder in staves.builders.values():
+            allocator = mpe.ChannelAllocator(mpe.MPE_MEMBER_CHANNELS, True)
+            notes = builder.notes
+            pitchbends = notes.pitchbends(mpe.PitchBendTable(mpe.PITCHBEND_RANGE))
+            for i in notes.sorted_indices():
+                allocator.allocate(notes.starts[i], notes.starts[i] + notes.durations[i], pitchbends[i][1])
+        times["allocate"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        tracks = dict(staves.encode())
+        times["encode"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        chunks = [staves.conductor_track()]
+        for staff in sorted(tracks):
+            chunks += tracks[staff]
+        with open(os.devnull, "wb") as f:
+            f.write(mpe.midi_header(len(chunks), ticks_per_quarter))
+            f.write(b"".join(chunks))
+        times["write"] = time.perf_counter() - start
+
+        for stage in STAGES:
+            best[stage] = min(best[stage], times[stage])
+
+        # Checked outside of the timed stages, every run encodes the same notes.
+        problems = [problem for chunk in chunks for problem in check_track(chunk)]
+        if problems:
+            raise ValueError(f"{len(problems)} problems in the encoded tracks, e.g. {problems[0]}")
+
+        output_size = sum(map(len, chunks))
+
+    # Allocation is part of encoding, so it isn't counted twice in the total.
+    total = sum(best[stage] for stage in STAGES if stage != "allocate")
+
+    return {
+        "notes": num_notes,
+        "tempo_changes": num_tempos,
+        "output_bytes": output_size,
+        "seconds": best,
+        "total_seconds": total,
+        "notes_per_second": {
+            **{stage: num_notes / seconds if seconds else None for (stage, seconds) in best.items()},
+            "total": num_notes / total if total else None,
+        },
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+
+
+def run_case_in_subprocess(path: str, repeat: int) -> dict:
+    """
+    Runs `run_case` in a new Python process, so that peak RSS isn't affected by earlier cases.
+    """
+    result = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--run-case", path, "--repeat", str(repeat)],
+        check=True, stdout=subprocess.PIPE,
+    )
+    return json.loads(result.stdout)
+
+
+def print_table(cases: List[dict]):
+    header = (
+        f"{'staves':>6} {'notes':>9} " + " ".join(f"{stage + ' s':>10}" for stage in STAGES) +
+        f" {'total s':>9} {'notes/s':>11} {'peak RSS':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+
+    for case in cases:
+        rss = case["peak_rss_bytes"]
+        print(
+            f"{case['staves']:>6} {case['notes']:>9} " +
+            " ".join(f"{case['seconds'][stage]:>10.4f}" for stage in STAGES) +
+            f" {case['total_seconds']:>9.4f} {case['notes_per_second']['total'] or 0:>11,.0f}"
+            f" {(f'{rss / 2**20:.1f} MiB' if rss is not None else 'n/a'):>10}"
+        )
+
+
+def main():
+    argparser = argparse.ArgumentParser("benchmark-mpe")
+    argparser.add_argument(
+        "--staves", type=int, nargs="+", default=[1, 8],
+        help="Number of staves of each synthetic score. (default: 1 8)")
+    argparser.add_argument(
+        "--notes", type=int, nargs="+", default=[10000, 100000],
+        help="Number of notes per staff of each synthetic score. (default: 10000 100000)")
+    argparser.add_argument(
+        "--tempo-changes", type=int, default=10,
+        help="Number of tempo changes in each score. (default: 10)")
+    argparser.add_argument(
+        "--chord-size", type=float, default=2.0,
+        help="Average number of notes per chord. (default: 2)")
+    argparser.add_argument(
+        "--cents-spread", type=float, default=50.0,
+        help="Cents offsets are picked in ± this range. (default: 50)")
+    argparser.add_argument(
+        "--cents-values", type=int, default=31,
+        help="Number of distinct cents offsets in each score. (default: 31)")
+    argparser.add_argument(
+        "--seed", type=int, default=0,
+        help="Random seed of the synthetic scores. (default: 0)")
+    argparser.add_argument(
+        "--repeat", type=int, default=3,
+        help="Number of times each case is run. The fastest time of each stage is kept. (default: 3)")
+    argparser.add_argument(
+        "--output", metavar="PATH",
+        help="Save the results as JSON to this path.")
+    argparser.add_argument(
+        "--generate", metavar="PATH",
+        help="Only write a synthetic .mid.csv file to this path, using the first --staves and "
+        "--notes values.")
+    argparser.add_argument("--run-case", metavar="PATH", help=argparse.SUPPRESS)
+    args = argparser.parse_args()
+
+    score_options = {
+        "tempo_changes": args.tempo_changes,
+        "chord_size": args.chord_size,
+        "cents_spread": args.cents_spread,
+        "cents_values": args.cents_values,
+        "seed": args.seed,
+    }
+
+    if args.run_case is not None:
+        json.dump(run_case(args.run_case, args.repeat), sys.stdout)
+        return
+
+    if args.generate is not None:
+        generate_score(args.generate, args.staves[0], args.notes[0], **score_options)
+        print(f'Generated "{args.generate}"')
+        return
+
+    cases = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for staves in args.staves:
+            for notes in args.notes:
+                print(f"Running {staves} staves x {notes} notes...", file=sys.stderr)
+                path = os.path.join(tmpdir, f"{staves}x{notes}.mid.csv")
+                generate_score(path, staves, notes, **score_options)
+                cases.append({
+                    "staves": staves,
+                    "notes_per_staff": notes,
+                    **run_case_in_subprocess(path, args.repeat),
+                })
+                os.remove(path)
+
+    print_table(cases)
+
+    if args.output is not None:
+        mpe = load_generate_mpe()
+        results = {
+            "generate_mpe_hash": mpe._script_hash().hex(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "options": {**score_options, "repeat": args.repeat},
+            "cases": cases,
+        }
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f'\nSaved results to "{args.output}"')
+
+
+if __name__ == "__main__":
+    main()
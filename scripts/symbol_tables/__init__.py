@@ -0,0 +1,12 @@
+"""
+Python access to the accidental symbol tables generated by scripts/tabulate_accidentals.py, for the
+scripts and tuning config generators. The plugin itself only reads generated-tables.js.
+
+Add the scripts/ folder to `sys.path` to import this package from outside of it.
+"""
+
+from .compact import CompactTables, encode_tables, write_tables
+from .table import (
+    COMPACT_TABLES_PATH, GENERATED_TABLES_PATH, InvalidSymbolError, SymbolTable, config_symbols,
+    load_symbol_table, validate_config, validate_symbols,
+)
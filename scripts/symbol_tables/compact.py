@@ -0,0 +1,137 @@
+"""
+Compact format of the accidental symbol tables (`CODE_TO_LABELS`, `TEXT_TO_CODE`, `SYMBOL_LAYOUT`),
+written to scripts/generated-tables.json by scripts/tabulate_accidentals.py. The plugin doesn't read
+this file, it only uses generated-tables.js.
+
+The JSON object has these keys:
+
+- `version`: `FORMAT_VERSION`.
+- `strings`: deduplicated label strings. Labels are referred to by their index in this list.
+- `labelStart`, `labels`: labels of each symbol code, flattened. The labels of symbol code `c` are
+  `labels[labelStart[c]:labelStart[c + 1]]`. Symbol code 0 has no labels.
+- `texts`, `textCodes`: text codes sorted by code point, and the symbol code of each one, so that
+  text codes are found by binary search.
+- `layoutLabels`, `layouts`: labels that have a custom layout, and their layouts as a flat list of
+  8 floats per label (4 for space notes, then 4 for line notes).
+"""
+
+import bisect
+import functools
+import json
+from typing import Dict, List, Optional, Sequence, Tuple
+
+FORMAT_VERSION = 1
+
+LAYOUT_SIZE = 8
+
+Layout = Tuple[List[float], List[float]]
+"""`(space_layout, line_layout)` of a symbol, 4 floats each."""
+
+
+def encode_tables(code_to_labels: Sequence[Sequence[str]], text_code_map: Dict[str, int],
+                  layout_map: Dict[str, Layout]) -> dict:
+    """
+    Packs the tables into the compact format.
+
+    `code_to_labels` are the labels of symbol codes 1, 2, 3, ... (symbol code 0 is always empty).
+    """
+    strings: List[str] = []
+    string_index: Dict[str, int] = {}
+
+    def index_of(label: str) -> int:
+        if label not in string_index:
+            string_index[label] = len(strings)
+            strings.append(label)
+        return string_index[label]
+
+    label_start = [0, 0]
+    labels = []
+    for code_labels in code_to_labels:
+        labels += [index_of(label) for label in code_labels]
+        label_start.append(len(labels))
+
+    texts = sorted(text_code_map)
+
+    layout_labels = []
+    layouts = []
+    for (label, (space_layout, line_layout)) in layout_map.items():
+        layout_labels.append(index_of(label))
+        layouts += list(space_layout) + list(line_layout)
+
+    return {
+        "version": FORMAT_VERSION,
+        "strings": strings,
+        "labelStart": label_start,
+        "labels": labels,
+        "texts": texts,
+        "textCodes": [text_code_map[text] for text in texts],
+        "layoutLabels": layout_labels,
+        "layouts": layouts,
+    }
+
+
+def write_tables(tables: dict, path: str):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(tables, f, separators=(",", ":"), ensure_ascii=False)
+
+
+class CompactTables:
+    """
+    Reader of the compact format. Lookups read the packed lists directly, nothing is unpacked when
+    loading.
+    """
+
+    def __init__(self, tables: dict):
+        if tables.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported symbol tables format version: {tables.get('version')}")
+
+        self.strings: List[str] = tables["strings"]
+        self.label_start: List[int] = tables["labelStart"]
+        self.label_indices: List[int] = tables["labels"]
+        self.texts: List[str] = tables["texts"]
+        self.text_codes: List[int] = tables["textCodes"]
+        self.layout_labels: List[int] = tables["layoutLabels"]
+        self.layouts: List[float] = tables["layouts"]
+
+    @classmethod
+    def load(cls, path: str) -> "CompactTables":
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    @property
+    def num_codes(self) -> int:
+        """Number of symbol codes, including symbol code 0."""
+        return len(self.label_start) - 1
+
+    def labels(self, code: int) -> List[str]:
+        """
+        Labels (SymIds first, then AccidentalTypes) of a symbol code, or an empty list if there is
+        no such code.
+        """
+        if not 0 <= code < self.num_codes:
+            return []
+        return [self.strings[i] for i in self.label_indices[self.label_start[code]:self.label_start[code + 1]]]
+
+    def code_of_text(self, text: str) -> Optional[int]:
+        """
+        Symbol code of a text code (e.g. `"#"`), or `None` if there is no such text code.
+        """
+        i = bisect.bisect_left(self.texts, text)
+        if i < len(self.texts) and self.texts[i] == text:
+            return self.text_codes[i]
+        return None
+
+    @functools.cached_property
+    def layout_map(self) -> Dict[str, Layout]:
+        """
+        Custom layouts by label, as `SYMBOL_LAYOUT` in generated-tables.js. Unpacked the first time
+        it is used.
+        """
+        layouts = {}
+        for (i, label_index) in enumerate(self.layout_labels):
+            flat = self.layouts[i * LAYOUT_SIZE:(i + 1) * LAYOUT_SIZE]
+            layouts[self.strings[label_index]] = (flat[:4], flat[4:])
+        return layouts
+
+    def layout(self, label: str) -> Optional[Layout]:
+        return self.layout_map.get(label)
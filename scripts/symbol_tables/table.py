@@ -0,0 +1,256 @@
+"""
+Indexed symbol table (symbol code <-> text code <-> labels), loaded once per process and cached
+on disk.
+"""
+
+import functools
+import os
+import pickle
+import re
+from typing import Dict, List, Optional, Union
+
+from .compact import CompactTables
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+GENERATED_TABLES_PATH = os.path.join(REPO_ROOT, "Xen Tuner", "generated-tables.js")
+
+COMPACT_TABLES_PATH = os.path.join(REPO_ROOT, "scripts", "generated-tables.json")
+
+CACHE_PATH = os.path.join(REPO_ROOT, "scripts", ".cache", "symbol_table.pickle")
+
+CACHE_VERSION = 1
+
+ESCAPABLE_CHARS = {"\\", "'", "/"}
+"""Characters that can follow a backslash in a symbols declaration (`VALID_ASCII_ACC_ESC_CHARS`)."""
+
+DECLARATION = re.compile(r"(lig|aux|sec|explicit|nobold|override|displaycents|displaysteps)\([0-9,a-zA-Z\s]*\)")
+"""Declarations that end the accidental chains of a tuning config, as in `parseTuningConfig`."""
+
+Symbol = Union[int, str]
+"""
+A parsed symbol: a symbol code, or an ASCII text symbol prefixed with a quote (e.g. `"'+"`), as in
+the plugin.
+"""
+
+
+class InvalidSymbolError(ValueError):
+    pass
+
+
+class SymbolTable:
+    """
+    The tables of generated-tables.js, indexed in both directions:
+
+    - `code_to_labels[code]`: labels (SymIds first, then AccidentalTypes) of a symbol code.
+    - `text_to_code[text]`: symbol code of a text code.
+    - `code_to_texts[code]`: text codes of a symbol code.
+    - `label_to_code[label]`: symbol code of a label.
+    """
+
+    def __init__(self, code_to_labels: List[List[str]], text_to_code: Dict[str, int]):
+        self.code_to_labels = code_to_labels
+        self.text_to_code = text_to_code
+
+        self.code_to_texts: Dict[int, List[str]] = {}
+        for (text, code) in text_to_code.items():
+            self.code_to_texts.setdefault(code, []).append(text)
+
+        self.label_to_code: Dict[str, int] = {}
+        for (code, labels) in enumerate(code_to_labels):
+            for label in labels:
+                self.label_to_code.setdefault(label, code)
+
+    @classmethod
+    def from_compact(cls, tables: CompactTables) -> "SymbolTable":
+        code_to_labels = [tables.labels(code) for code in range(tables.num_codes)]
+        return cls(code_to_labels, dict(zip(tables.texts, tables.text_codes)))
+
+    def read_symbol_code(self, code_or_text: str) -> Optional[int]:
+        """
+        Symbol code of a text code or a symbol code number, or `None` if invalid. Same as
+        `readSymbolCode` in fns.js.
+        """
+        code_or_text = code_or_text.strip()
+        code = self.text_to_code.get(code_or_text)
+        if code is None:
+            try:
+                code = int(code_or_text)
+            except ValueError:
+                return None
+        if not 0 <= code < len(self.code_to_labels):
+            return None
+        return code
+
+    def parse_symbols(self, declaration: str) -> List[Symbol]:
+        """
+        Parses a symbols declaration of a tuning config, e.g. `#.'+'`, the same way as
+        `parseSymbolsDeclaration` in fns.js. Raises `InvalidSymbolError` where the plugin would show
+        a tuning config error.
+        """
+        symbols: List[Symbol] = []
+        is_quoted = False
+        is_escape = False
+        current = ""
+        current_is_quoted = False
+
+        def end_symbol():
+            if current_is_quoted:
+                symbols.append("'" + current)
+                return
+            code = self.read_symbol_code(current)
+            if code is None:
+                raise InvalidSymbolError(f"Invalid symbol: {current} (in {declaration})")
+            symbols.append(code)
+
+        for c in declaration:
+            if is_escape:
+                if c not in ESCAPABLE_CHARS:
+                    raise InvalidSymbolError(f"Invalid escape sequence: \\{c} (in {declaration})")
+                is_escape = False
+                current += c
+            elif c == "\\":
+                is_escape = True
+            elif c == "'":
+                is_quoted = not is_quoted
+                current_is_quoted = True
+            elif c == "." and not is_quoted:
+                end_symbol()
+                current = ""
+                current_is_quoted = False
+            else:
+                current += c
+
+        if is_quoted:
+            raise InvalidSymbolError(f"Symbol is missing closing quote: {declaration}")
+
+        # A trailing period or empty quotes don't add a symbol.
+        if current:
+            end_symbol()
+
+        return symbols
+
+    def validate(self, *declarations: str):
+        """
+        Raises `InvalidSymbolError` if any of the symbols declarations would be rejected by the
+        plugin.
+        """
+        for declaration in declarations:
+            self.parse_symbols(declaration)
+
+    def validate_config(self, config: str):
+        """
+        Raises `InvalidSymbolError` if any symbols declaration of a tuning config would be rejected by
+        the plugin, see `config_symbols`.
+        """
+        self.validate(*config_symbols(config))
+
+
+def _strip_offset(word: str) -> str:
+    """
+    Symbols declaration of an accidental chain degree, without its `(offset)`, like
+    `parseSymbolOffsetPair` in fns.js.
+    """
+    if not word.endswith(")"):
+        return word
+    depth = 1
+    for i in range(len(word) - 2, 0, -1):
+        depth += {")": 1, "(": -1}.get(word[i], 0)
+        if depth == 0:
+            # An offset that isn't a number is part of the symbols.
+            return word[:i] if re.search(r"\d", word[i + 1:-1]) else word
+    return word
+
+
+def config_symbols(config: str) -> List[str]:
+    """
+    Symbols declarations of a tuning config: the degrees of accidental chains, ligatures, secondary
+    accidentals and independent symbol groups, found the same way as in `parseTuningConfig` in
+    fns.js.
+    """
+    text = re.sub(r"^(.*?)//.*$", r"\1", config, flags=re.MULTILINE)
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if len(lines) < 2:
+        return []
+
+    num_nominals = len(lines[1].split()) - 1
+    declarations = []
+
+    for i in range(2, len(lines) + 1):
+        if i == len(lines) or DECLARATION.search(lines[i]):
+            break
+        declarations += [_strip_offset(word) for word in lines[i].split() if not re.fullmatch(r"\(.+\)", word)]
+
+    state = None
+
+    for line in lines[i:]:
+        if re.match(r"(lig|aux|override|independent)\(", line) or line in ("sec()", "nobold()", "explicit()"):
+            state = line.split("(")[0]
+            continue
+        if re.match(r"display(cents|steps)\(", line):
+            continue
+
+        words = line.split()
+        if state == "lig":
+            declarations.append(words[-1])
+        elif state == "sec":
+            declarations.append(words[0])
+            # The second word is converted to from the first, unless it is one of the tunings.
+            if len(words) in (3, 3 + num_nominals - 1) and num_nominals != 2:
+                declarations.append(words[1])
+        elif state == "independent":
+            declarations += words
+
+    return declarations
+
+
+def _source_stamp(path: str) -> tuple:
+    stat = os.stat(path)
+    return (CACHE_VERSION, path, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=None)
+def load_symbol_table(path: str = COMPACT_TABLES_PATH) -> SymbolTable:
+    """
+    Loads the symbol table from the compact tables file written by scripts/tabulate_accidentals.py.
+
+    The indexed table is pickled to `CACHE_PATH`, and loaded from there as long as the tables file
+    hasn't changed. Within a process, the table is only loaded once.
+    """
+    stamp = _source_stamp(path)
+
+    try:
+        with open(CACHE_PATH, "rb") as f:
+            (cached_stamp, table) = pickle.load(f)
+        if cached_stamp == stamp:
+            return table
+    except (OSError, pickle.UnpicklingError, EOFError, ValueError, AttributeError):
+        pass
+
+    table = SymbolTable.from_compact(CompactTables.load(path))
+
+    try:
+        os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+        with open(CACHE_PATH + ".tmp", "wb") as f:
+            pickle.dump((stamp, table), f)
+        os.replace(CACHE_PATH + ".tmp", CACHE_PATH)
+    except OSError:
+        # The cache is only an optimisation.
+        pass
+
+    return table
+
+
+def validate_symbols(*declarations: str):
+    """
+    Checks symbols declarations against the symbol table, see `SymbolTable.validate`.
+    """
+    load_symbol_table().validate(*declarations)
+
+
+def validate_config(config: str):
+    """
+    Checks the symbols declarations of a tuning config against the symbol table, see
+    `SymbolTable.validate_config`.
+    """
+    load_symbol_table().validate_config(config)
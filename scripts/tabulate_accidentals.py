@@ -1,82 +1,211 @@
 """
 Code generator for CODE_TO_LABELS, TEXT_TO_CODE, SYMBOL_LAYOUT, lookup objects for tabulating accidental symbols.
 
-Downloads .csv from Google Sheets (HTTP GET) and generates generated-tables.js
+Downloads .csv from Google Sheets (HTTP GET) and generates generated-tables.js, and the same tables in the
+compact format of symbol_tables/compact.py as scripts/generated-tables.json for the Python scripts
+
+The download is cached in scripts/.cache. The cached copy is revalidated with the ETag/Last-Modified
+of the last download, and used as is when offline. Use --csv to read a local .csv export of the sheet
+instead.
+
+The generated files are only rewritten when the tables parsed from the .csv have changed.
 """
 
+import argparse
 import csv
+import hashlib
+import json
+import os
+import time
+import urllib.error
 import urllib.request
 
+from symbol_tables import encode_tables, write_tables
+
 SHEET_URL = "https://docs.google.com/spreadsheets/d/1kRBJNl-jdvD9BBgOMJQPcVOHjdXurx5UFWqsPf46Ffw/gviz/tq?tqx=out:csv&sheet=CSV+export"
 
-with urllib.request.urlopen(SHEET_URL) as csv_download:
-    with open('Xen Tuner/generated-tables.js', 'w') as f:
-        csv_data = csv_download.read().decode('utf-8')
+OUTPUT_PATH = 'Xen Tuner/generated-tables.js'
+
+COMPACT_OUTPUT_PATH = 'scripts/generated-tables.json'
+
+CACHE_DIR = 'scripts/.cache'
+CACHED_CSV_PATH = os.path.join(CACHE_DIR, 'accidentals.csv')
+# ETag and Last-Modified headers of the cached download.
+CACHE_INFO_PATH = os.path.join(CACHE_DIR, 'accidentals.json')
+
+# Number of lines before the first row of the table in the CSV export.
+# If CSV export format is changed, this may have to be changed to a different number
+HEADER_LINES = 5
+
+HASH_COMMENT = '// Tables hash: '
+
+
+def download_csv(max_age=0, offline=False):
+    """
+    Returns the CSV export of the Google Sheet, using the cached download if it is newer than
+    `max_age` seconds, if the sheet hasn't changed since, or if the sheet can't be downloaded.
+    """
+    cached = None
+    info = {}
+
+    if os.path.exists(CACHED_CSV_PATH):
+        with open(CACHED_CSV_PATH, encoding='utf-8') as f:
+            cached = f.read()
+        if os.path.exists(CACHE_INFO_PATH):
+            with open(CACHE_INFO_PATH) as f:
+                info = json.load(f)
+
+    if cached is not None:
+        if offline:
+            print('Using cached download (offline)')
+            return cached
+        if time.time() - os.path.getmtime(CACHED_CSV_PATH) < max_age:
+            print(f'Using cached download (less than {max_age}s old)')
+            return cached
+    elif offline:
+        raise SystemExit(f'ERROR: --offline given, but there is no cached download in {CACHE_DIR}.')
+
+    headers = {}
+    if cached is not None:
+        if 'etag' in info:
+            headers['If-None-Match'] = info['etag']
+        if 'last_modified' in info:
+            headers['If-Modified-Since'] = info['last_modified']
+
+    try:
+        with urllib.request.urlopen(urllib.request.Request(SHEET_URL, headers=headers), timeout=30) as response:
+            csv_data = response.read().decode('utf-8')
+            info = {}
+            if response.headers.get('ETag'):
+                info['etag'] = response.headers['ETag']
+            if response.headers.get('Last-Modified'):
+                info['last_modified'] = response.headers['Last-Modified']
+    except urllib.error.HTTPError as e:
+        if e.code == 304 and cached is not None:
+            print('Sheet not modified, using cached download')
+            os.utime(CACHED_CSV_PATH)
+            return cached
+        if cached is None:
+            raise SystemExit(f'ERROR: Could not download the sheet (HTTP {e.code}), and there is no cached download.')
+        print(f'WARNING: Could not download the sheet (HTTP {e.code}), using cached download')
+        return cached
+    except urllib.error.URLError as e:
+        if cached is None:
+            raise SystemExit(f'ERROR: Could not download the sheet ({e.reason}), and there is no cached download.')
+        print(f'WARNING: Could not download the sheet ({e.reason}), using cached download')
+        return cached
+
+    print('Downloaded sheet')
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(CACHED_CSV_PATH, 'w', encoding='utf-8') as f:
+        f.write(csv_data)
+    with open(CACHE_INFO_PATH, 'w') as f:
+        json.dump(info, f)
+
+    return csv_data
+
+
+def parse_tables(csv_data):
+    """
+    Parses the CSV export of the sheet into `(code_to_labels, text_code_map, layout_map)`.
+
+    `code_to_labels` is the list of label lists of each symbol code (without the null at code 0),
+    `text_code_map` maps text codes to symbol codes, and `layout_map` maps labels to
+    `[space_layout, line_layout]`.
+    """
+    # Remove the first 5 lines of the csv
+    csv_data = csv_data.split('\n', HEADER_LINES)[HEADER_LINES]
+
+    reader = csv.reader(csv_data.splitlines(), delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL, skipinitialspace=True)
 
-        # Remove the first 5 lines of the csv
-        # If CSV export format is changed, this may have to be changed to a different number
-        csv_data = csv_data.split('\n', 5)[5]
+    code_to_labels = []
 
-        print('downloaded + trimmed csv data: \n' + csv_data)
+    text_code_map = {}
 
-        reader = csv.reader(csv_data.splitlines(), delimiter=',', quotechar='"', quoting=csv.QUOTE_ALL, skipinitialspace=True)
+    # Only contains non-default layout settings
+    # The default layout setting is in the Google Sheet
+    layout_map = {}
 
-        text_code_map = {}
+    for row in reader:
+        sym_code = int(row[0].strip())
+        text_code = row[1].strip()
+        layout = []
 
-        # Only contains non-default layout settings
-        # The default layout setting is in the Google Sheet
-        layout_map = {}
+        try:
+            layout = [float(x) for x in row[2].strip().split(' ')]
+        except ValueError:
+            pass
 
-        f.write('var CODE_TO_LABELS = [\n')
-        # SymCode 0 should be null.
-        # to premptively prevent dumb js falsey errors.
-        f.write('    null,\n')
+        ids = [x.strip() for x in row[3:] if len(x.strip()) != 0]
 
-        for row in reader:
-            sym_code = int(row[0].strip())
-            text_code = row[1].strip()
-            layout = []
+        if len(text_code) != 0:
+            text_code_map[text_code] = sym_code
 
-            try:
-                layout = [float(x) for x in row[2].strip().split(' ')]
-            except:
-                pass
+        if len(layout) == 4:
+            for id in ids:
+                layout_map[id] = [layout, layout]
+        elif len(layout) == 8:
+            for id in ids:
+                layout_map[id] = [layout[:4], layout[4:]]
 
-            ids = [f'{repr(x.strip())}' for x
-                in row[3:] if len(x.strip()) != 0]
+        if len(ids) != 0:
+            code_to_labels.append(ids)
 
-            if len(text_code) != 0:
-                text_code_map[text_code] = sym_code
+    return code_to_labels, text_code_map, layout_map
 
-            if len(layout) == 4:
-                for id in ids:
-                    layout_map[id] = [layout, layout]
-            elif len(layout) == 8:
-                for id in ids:
-                    layout_map[id] = [layout[:4], layout[4:]]
 
-            if len(ids) != 0:
-                f.write(f'    [{",".join(ids)}],\n')
+def tables_hash(tables):
+    return hashlib.sha256(json.dumps(tables).encode()).hexdigest()
 
-        f.write('];\n\n\n')
 
-        f.write('var TEXT_TO_CODE = {\n')
+def read_tables_hash(path):
+    """
+    Returns the tables hash written at the top of a previously generated file, or None.
+    """
+    try:
+        with open(path, encoding='utf-8') as f:
+            first_line = f.readline().strip()
+    except FileNotFoundError:
+        return None
 
-        for k, v in text_code_map.items():
-            f.write(f'    {repr(k)}: {v},\n')
+    if first_line.startswith(HASH_COMMENT):
+        return first_line[len(HASH_COMMENT):]
+    return None
 
-        f.write('};\n\n\n')
 
-        f.write('var SYMBOL_LAYOUT = {\n')
+def write_js(tables, table_hash, f):
+    (code_to_labels, text_code_map, layout_map) = tables
 
-        for symbol_code, [space_layout, line_layout] in layout_map.items():
-            space_lay_str = ','.join([str(x) for x in space_layout])
-            line_lay_str = ','.join([str(x) for x in line_layout])
-            f.write(f'    {symbol_code}: [[{space_lay_str}], [{line_lay_str}]],\n')
+    f.write(f'{HASH_COMMENT}{table_hash}\n')
 
-        f.write('};\n')
+    f.write('var CODE_TO_LABELS = [\n')
+    # SymCode 0 should be null.
+    # to premptively prevent dumb js falsey errors.
+    f.write('    null,\n')
 
-        f.write("""
+    for ids in code_to_labels:
+        f.write(f'    [{",".join(repr(id) for id in ids)}],\n')
+
+    f.write('];\n\n\n')
+
+    f.write('var TEXT_TO_CODE = {\n')
+
+    for k, v in text_code_map.items():
+        f.write(f'    {repr(k)}: {v},\n')
+
+    f.write('};\n\n\n')
+
+    f.write('var SYMBOL_LAYOUT = {\n')
+
+    for symbol_code, [space_layout, line_layout] in layout_map.items():
+        space_lay_str = ','.join([str(x) for x in space_layout])
+        line_lay_str = ','.join([str(x) for x in line_layout])
+        f.write(f'    {repr(symbol_code)}: [[{space_lay_str}], [{line_lay_str}]],\n')
+
+    f.write('};\n')
+
+    f.write("""
 function ImportGenerated() {
     return {
         CODE_TO_LABELS: CODE_TO_LABELS,
@@ -86,4 +215,53 @@ function ImportGenerated() {
 }
 """)
 
-print('Exported to generated-tables.js')
+
+def main():
+    argparser = argparse.ArgumentParser('tabulate_accidentals')
+    argparser.add_argument(
+        '--csv', metavar='PATH',
+        help='Read a local .csv export of the sheet instead of downloading it.')
+    argparser.add_argument(
+        '--offline', action='store_true',
+        help='Use the cached download without checking whether the sheet has changed.')
+    argparser.add_argument(
+        '--max-age', type=float, default=0, metavar='SECONDS',
+        help='Use the cached download without checking the sheet if it is newer than this. (default: 0)')
+    argparser.add_argument(
+        '--output', default=OUTPUT_PATH, metavar='PATH',
+        help=f'Path of the generated .js file. (default: {OUTPUT_PATH})')
+    argparser.add_argument(
+        '--compact-output', default=COMPACT_OUTPUT_PATH, metavar='PATH',
+        help=f'Path of the compact .json file read by the Python scripts. (default: {COMPACT_OUTPUT_PATH})')
+    argparser.add_argument(
+        '--force', action='store_true',
+        help='Rewrite the generated files even if the tables haven\'t changed.')
+    args = argparser.parse_args()
+
+    if args.csv is not None:
+        with open(args.csv, encoding='utf-8') as f:
+            csv_data = f.read()
+    else:
+        csv_data = download_csv(args.max_age, args.offline)
+
+    tables = parse_tables(csv_data)
+    table_hash = tables_hash(tables)
+
+    print(f'Parsed {len(tables[0])} symbol codes, {len(tables[1])} text codes, {len(tables[2])} layouts')
+
+    compact_path = args.compact_output
+
+    if not args.force and read_tables_hash(args.output) == table_hash and os.path.exists(compact_path):
+        print(f'Tables unchanged, not rewriting {args.output}')
+        return
+
+    with open(args.output, 'w') as f:
+        write_js(tables, table_hash, f)
+
+    write_tables(encode_tables(*tables), compact_path)
+
+    print(f'Exported to {args.output} and {compact_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -22,8 +22,13 @@ On Windows, use `py` instead of `python3`.
 """
 
 import math
+import os
+import sys
 from fractions import Fraction
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scripts"))
+from symbol_tables import validate_symbols
+
 # ---------------------------------------------
 #
 #              CHOOSE OPTIONS HERE
@@ -414,4 +419,9 @@ sec()
 """
 
 if __name__ == "__main__":
+    # Check the accidental chains against the symbol table, skipping the (tuning) of each chain.
+    validate_symbols(*(
+        symbols for chain in [chain_3_str, chain_5_str, chain_7_str]
+        for symbols in chain.split() if not symbols.startswith('(')
+    ))
     print(TUNING_CONFIG)
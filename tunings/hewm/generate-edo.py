@@ -1,62 +1,138 @@
+"""
+Generates regularly mapped HEWM tuning configs for EDOs.
+
+Writes 41edo.txt to the current folder by default. To generate many EDOs at once:
+
+```
+python3 tunings/hewm/generate-edo.py 12 17c 41 100-200 -o tunings/hewm
+```
+
+EDOs are given as numbers or ranges, using the patent val (the closest mapping of every prime)
+unless the EDO is suffixed with wart letters: a for 2, b for 3, c for 5, d for 7, etc. Each
+repetition of a prime's letter picks its next closest mapping, e.g. 17c maps 5 to its second
+closest number of steps. Wart EDOs are written as e.g. 17cedo.txt.
+"""
+
+import argparse
+import functools
 import math
+import os
+import re
+import string
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scripts"))
+from symbol_tables import validate_config
+
+PRIME_LIMIT = 61 # The highest prime used in the tuning config text below
+EDO = 41 # Generated when no EDOs are given on the command line
+
+SIEVE_SIZE = 1 << 12
+"""
+Initial size of the smallest prime factor sieve. The sieve grows as needed to factorize larger
+integers.
+"""
+
+
+def smallest_prime_factor_sieve(size):
+    """
+    Returns a list where `spf[n]` is the smallest prime factor of `n` for `2 <= n < size`.
+    """
+    spf = list(range(size))
+    for i in range(2, math.isqrt(size - 1) + 1):
+        if spf[i] == i:
+            for j in range(i * i, size, i):
+                if spf[j] == j:
+                    spf[j] = i
+    return spf
+
+
+spf = smallest_prime_factor_sieve(max(SIEVE_SIZE, PRIME_LIMIT + 1))
 
-PRIME_LIMIT = 61 # The highest prime used in the TUNING_CONFIG text below
-EDO = 41
-OUT_FILE_NAME = f"{EDO}edo.txt"
+list_of_primes = [p for p in range(2, PRIME_LIMIT + 1) if spf[p] == p]
 
-list_of_primes = []
+prime_index = {p: i for (i, p) in enumerate(list_of_primes)}
 
-for i in range(2, PRIME_LIMIT + 1):
-    is_prime = True
-    for j in list_of_primes:
-        if i % j == 0:
-            is_prime = False
-            break
-    
-    if is_prime:
-        list_of_primes.append(i)
-        
 
 def prime_factors(n):
+    """
+    Prime factors of the positive integer n in ascending order, with repeats.
+    """
+    global spf
     assert n > 0
-    
+
+    if n >= len(spf):
+        spf = smallest_prime_factor_sieve(max(n + 1, 2 * len(spf)))
+
     factors = []
-    for p in list_of_primes:
-        while n % p == 0:
-            n /= p
-            factors.append(p)
-        
-        if n == 1:
-            break
+    while n > 1:
+        p = spf[n]
+        factors.append(p)
+        n //= p
     return factors
 
 
-mapping = {} # contains cents of each prime
+@functools.lru_cache(maxsize=None)
+def monzo(n):
+    """
+    Exponents of `list_of_primes` in the prime factorization of n.
+    """
+    exponents = [0] * len(list_of_primes)
+    for p in prime_factors(n):
+        if p not in prime_index:
+            raise ValueError(f"{n} has prime factor {p}, which is above PRIME_LIMIT = {PRIME_LIMIT}")
+        exponents[prime_index[p]] += 1
+    return tuple(exponents)
+
+
+def mapping(edo, p, wart=0):
+    """
+    Number of edosteps of prime p in the EDO. `wart = 0` gives the closest mapping (patent val),
+    `wart = 1` the second closest, and so on.
+    """
+    steps = math.log2(p) * edo
+    candidates = range(math.floor(steps) - wart, math.floor(steps) + wart + 2)
+    return sorted(candidates, key=lambda s: abs(s - steps))[wart]
+
+
+def val_matrix(edos, warts=None):
+    """
+    Returns the (EDO x prime) matrix of edosteps of each of `list_of_primes`, one row per EDO.
+
+    `warts[i]` maps primes to the wart count of `edos[i]`, see `mapping`.
+    """
+    # The patent vals of all EDOs are the rounded outer product of the EDOs and prime sizes.
+    sizes = [math.log2(p) for p in list_of_primes]
+    matrix = [[round(edo * size) for size in sizes] for edo in edos]
+
+    for (row, edo, edo_warts) in zip(matrix, edos, warts or []):
+        for (p, wart) in edo_warts.items():
+            row[prime_index[p]] = mapping(edo, p, wart)
+
+    return matrix
 
-for p in list_of_primes:
-    # MODIFY THIS
-    # adjust this to produce required interval of each prime
-    # this example calculates prime mappings for the patent val of
-    # 311 edo.
-    mapping[p] = round(math.log2(p) * EDO) / EDO * 1200
 
-def t(num, den):
+# MODIFY THIS
+# adjust val_matrix (or the val passed to tuning_config) to produce the required interval of each
+# prime. By default every EDO uses its patent val.
+def tuning_config(edo, val):
     """
-    Retrieve tempered interval from mapped ratio in cents.
-    Outputs cents as a decimal.
+    Returns the HEWM tuning config of the EDO, where `val` is the number of edosteps of each of
+    `list_of_primes`.
     """
-    cents = 0
-    for p in prime_factors(num):
-        cents += mapping[p]
-    
-    for p in prime_factors(den):
-        cents -= mapping[p]
-    
-    return cents
-
-
-TUNING_CONFIG = f"""
-// {EDO}edo notated as tempered HEWM using text-based accidentals
+    step_cents = 1200 / edo
+
+    def t(num, den):
+        """
+        Retrieve tempered interval from mapped ratio in cents.
+        Outputs cents as a decimal.
+        """
+        steps = sum(v * (a - b) for (v, a, b) in zip(val, monzo(num), monzo(den)))
+        return steps * step_cents
+
+    return f"""
+// {edo}edo notated as tempered HEWM using text-based accidentals
 // Main accidental chains consist of:
 // 3 standard sharps/flats
 // 3 syntonic commas up/down notated as + -
@@ -71,7 +147,7 @@ bbb bb b ({t(2187,2048)}c) # x #x
 '-'.'-'.'-' '-'.'-' '-' ({t(81,80)}c) '+' '+'.'+' '+'.'+'.'+'
 '<'.'<' '<' ({t(64,63)}c) '>' '>'.'>'
 
-displaysteps({EDO}, below)
+displaysteps({edo}, below)
 
 aux(0)
 aux(1)
@@ -125,5 +201,76 @@ sec()
 'y' {t(243,244)}c
 """.strip()
 
-with open(OUT_FILE_NAME, 'w') as f:
-    f.write(TUNING_CONFIG)
\ No newline at end of file
+
+WART_LETTERS = string.ascii_lowercase[:len(list_of_primes)]
+
+
+def parse_edos(spec):
+    """
+    Parses an EDO argument: `41`, `17c` or a range `1-1000`. Returns a list of
+    `(name, edo, warts)`, where `warts` maps primes to wart counts.
+    """
+    match = re.fullmatch(r"(\d+)-(\d+)", spec)
+    if match:
+        (first, last) = (int(match[1]), int(match[2]))
+        if not 1 <= first <= last:
+            raise argparse.ArgumentTypeError(f"invalid EDO range: {spec}")
+        return [(str(edo), edo, {}) for edo in range(first, last + 1)]
+
+    match = re.fullmatch(rf"(\d+)([{WART_LETTERS}]*)", spec)
+    if not match or int(match[1]) < 1:
+        raise argparse.ArgumentTypeError(
+            f"invalid EDO: {spec} (expected e.g. 41, 17c or 1-1000, wart letters a-{WART_LETTERS[-1]})")
+
+    warts = {}
+    for letter in match[2]:
+        p = list_of_primes[WART_LETTERS.index(letter)]
+        warts[p] = warts.get(p, 0) + 1
+
+    return [(spec, int(match[1]), warts)]
+
+
+def write_config(path, config):
+    with open(path, 'w') as f:
+        f.write(config)
+
+
+def main():
+    argparser = argparse.ArgumentParser(
+        'generate-edo', description='Generates regularly mapped HEWM tuning configs for EDOs.')
+    argparser.add_argument(
+        'edos', type=parse_edos, nargs='*', metavar='EDO',
+        help=f'EDOs to generate, e.g. 41, 17c (wart letters a-{WART_LETTERS[-1]} for primes 2-{PRIME_LIMIT}) or 1-1000. '
+        f'(default: {EDO})')
+    argparser.add_argument(
+        '-o', '--output-dir', default='.', metavar='DIR',
+        help='Folder to write the <EDO>edo.txt files to. (default: current folder)')
+    argparser.add_argument(
+        '-j', '--jobs', type=int, default=os.cpu_count() or 1,
+        help='Number of files to write in parallel. (default: number of CPUs)')
+    args = argparser.parse_args()
+
+    edos = [edo for spec in args.edos for edo in spec] or [(str(EDO), EDO, {})]
+
+    matrix = val_matrix([edo for (_, edo, _) in edos], [warts for (_, _, warts) in edos])
+    configs = [tuning_config(edo, val) for ((_, edo, _), val) in zip(edos, matrix)]
+
+    # Check every config before writing any of them.
+    for config in configs:
+        validate_config(config)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    with ThreadPoolExecutor(max(args.jobs, 1)) as pool:
+        writes = [
+            pool.submit(write_config, os.path.join(args.output_dir, f"{name}edo.txt"), config)
+            for ((name, _, _), config) in zip(edos, configs)
+        ]
+        for write in writes:
+            write.result()
+
+    print(f"Generated {len(edos)} tuning config{'s' if len(edos) != 1 else ''} in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
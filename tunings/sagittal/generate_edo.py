@@ -1,12 +1,20 @@
 """
 Generates EDOs for sagittal tunings.
 
-Run this script from the root directory of Xen Tuner (not from here).
-
 ```sh
 python tunings/sagittal/generate_edo.py
 ```
 
+By default, all edos in edo_definitions.json are generated next to this script. To only regenerate
+some of them:
+
+```sh
+python tunings/sagittal/generate_edo.py --edo 311 --edo 100-200 --variant revo
+python tunings/sagittal/generate_edo.py --filter "edo % 12 == 0 and steps <= 3" -o out/
+```
+
+See `--help` for all options.
+
 
 Methodology:
 
@@ -20,8 +28,22 @@ non-ligatured accidentals from being used, so that only Revo symbols can be obta
 up/down or enharmonic cycling operations.
 """
 
+import argparse
+import bisect
+import contextlib
+import functools
+import hashlib
+import io
 import math
 import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scripts"))
+from symbol_tables import validate_symbols
 
 # ============== CONFIGURE SETTINGS HERE ===================
 
@@ -204,6 +226,59 @@ Cents value of the upper bound of the capture zone of the last sagittal symbol i
 tuning.
 """
 
+class CaptureZones:
+    """
+    Sorted index of the capture zones of an accuracy level (`PROMETHEAN` or `ATHENIAN`), for looking
+    up the single-shaft symbol of a cents value.
+
+    Zone `i` spans `[lower_bounds[i], lower_bounds[i + 1])`, and the last zone ends at `upper_bound`.
+    """
+
+    def __init__(self, zones: dict[str, float], upper_bound: float = UPPER_BOUND):
+        sorted_zones = sorted(zones.items(), key=lambda zone: zone[1])
+        self.symbols = [symbol for (symbol, _) in sorted_zones]
+        self.lower_bounds = [lower_bound for (_, lower_bound) in sorted_zones]
+        self.upper_bound = upper_bound
+
+    def _symbol_at(self, index: int, cents: float) -> str | None:
+        if index < 0 or abs(cents) >= self.upper_bound:
+            return None
+        return self.symbols[index] if cents >= 0 else flip(self.symbols[index])
+
+    def symbol(self, cents: float) -> str | None:
+        """
+        Returns the symbol whose capture zone contains `cents` (flipped for negative cents), or `None`
+        if it's below the first zone (no symbol needed) or above `upper_bound`.
+        """
+        return self._symbol_at(bisect.bisect_right(self.lower_bounds, abs(cents)) - 1, cents)
+
+    def symbols_of(self, cents_values: Iterable[float]) -> list[str | None]:
+        """
+        Batch version of `symbol`. Tuning files repeat the same few cents values many times, so each
+        distinct value is only looked up once.
+        """
+        lookup = bisect.bisect_right
+        lower_bounds = self.lower_bounds
+        found: dict[float, str | None] = {}
+        symbols = []
+
+        for cents in cents_values:
+            if cents not in found:
+                found[cents] = self._symbol_at(lookup(lower_bounds, abs(cents)) - 1, cents)
+            symbols.append(found[cents])
+
+        return symbols
+
+
+PROMETHEAN_ZONES = CaptureZones(PROMETHEAN)
+
+ATHENIAN_ZONES = CaptureZones(ATHENIAN)
+
+ACCURACY_ZONES = {
+    "promethean": PROMETHEAN_ZONES,
+    "athenian": ATHENIAN_ZONES,
+}
+
 PROMETHEAN_CHAR_WHITELIST = set([
     '(',
     ')',
@@ -250,24 +325,17 @@ def flip(sagittal: str) -> str:
 
 
 
-class ShaftExceededException(Exception):
-    """
-    Exception raised when the number of shafts exceeds the maximum allowed (4) for a sagittal
-    symbol.
-
-    This usually happens when taking the complement of a double sharp/flat symbol.
-
-    In this case, do not create the ligature for this symbol.
-    """
+NO_LIGATURE = None
+"""
+Returned instead of a symbol when the number of shafts would exceed the maximum allowed (4) for a
+sagittal symbol, or go below 1.
 
-    def __init__(self, message: str = ""):
-        super().__init__(message)
-        self.message = message
+This usually happens when taking the complement of a double sharp/flat symbol.
 
-    def __str__(self):
-        return f"ShaftExceededException: {self.message}"
+In this case, do not create the ligature for this symbol.
+"""
 
-def add_shafts(sagittal: str, shafts: int) -> str:
+def add_shafts(sagittal: str, shafts: int) -> str | None:
     """
     Adds/subtracts the given number of shafts to the sagittal symbol.
 
@@ -280,9 +348,9 @@ def add_shafts(sagittal: str, shafts: int) -> str:
     - shafts: The number of shafts to add (positive) or subtract (negative). NOTE: you cannot
       subtract shafts below 1. To flip the direction of the symbol, use the `flip` function.
 
-    ## Raises:
+    ## Returns:
 
-    - ShaftExceededException: If the number of shafts exceeds 4, or goes below 1.
+    The modified symbol, or `NO_LIGATURE` if the number of shafts exceeds 4, or goes below 1.
     """
     if shafts == 0:
         # no change, just return the original symbol
@@ -299,10 +367,8 @@ def add_shafts(sagittal: str, shafts: int) -> str:
     # There's so few cases, we can just brute force them.
 
     if "X" in upward_sagittal:
-        if shafts < -3:
-            raise ShaftExceededException(f"Detected 4 shafts, cannot subtract {shafts} shafts from {sagittal}.")
-        if shafts > 0:
-            raise ShaftExceededException(f"Detected 4 shafts, cannot add {shafts} shafts to {sagittal}.")
+        if shafts < -3 or shafts > 0:
+            return NO_LIGATURE
         match shafts:
             case -3:
                 upward_sagittal = upward_sagittal.replace("X", "|")
@@ -311,10 +377,8 @@ def add_shafts(sagittal: str, shafts: int) -> str:
             case -1:
                 upward_sagittal = upward_sagittal.replace("X", "|||")
     elif "|||" in upward_sagittal:
-        if shafts < -2:
-            raise ShaftExceededException(f"Detected 3 shafts, cannot subtract {shafts} shafts from {sagittal}.")
-        if shafts > 1:
-            raise ShaftExceededException(f"Detected 3 shafts, cannot add {shafts} shafts to {sagittal}.")
+        if shafts < -2 or shafts > 1:
+            return NO_LIGATURE
         match shafts:
             case -2:
                 upward_sagittal = upward_sagittal.replace("|||", "|")
@@ -323,10 +387,8 @@ def add_shafts(sagittal: str, shafts: int) -> str:
             case 1:
                 upward_sagittal = upward_sagittal.replace("|||", "X")
     elif "||" in upward_sagittal:
-        if shafts < -1:
-            raise ShaftExceededException(f"Detected 2 shafts, cannot subtract {shafts} shafts from {sagittal}.")
-        if shafts > 2:
-            raise ShaftExceededException(f"Detected 2 shafts, cannot add {shafts} shafts to {sagittal}.")
+        if shafts < -1 or shafts > 2:
+            return NO_LIGATURE
         match shafts:
             case -1:
                 upward_sagittal = upward_sagittal.replace("||", "|")
@@ -335,10 +397,8 @@ def add_shafts(sagittal: str, shafts: int) -> str:
             case 2:
                 upward_sagittal = upward_sagittal.replace("||", "X")
     elif "|" in upward_sagittal:
-        if shafts < 0:
-            raise ShaftExceededException(f"Detected 1 shaft, cannot subtract {shafts} shafts from {sagittal}.")
-        if shafts > 3:
-            raise ShaftExceededException(f"Detected 1 shaft, cannot add {shafts} shafts to {sagittal}.")
+        if shafts < 0 or shafts > 3:
+            return NO_LIGATURE
         match shafts:
             case 1:
                 upward_sagittal = upward_sagittal.replace("|", "||")
@@ -353,7 +413,90 @@ def add_shafts(sagittal: str, shafts: int) -> str:
     return upward_sagittal
 
 
-def make_revo(apotomes: int, edosteps: int, step_symbols: list[str], apotome_size: int) -> str:
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFINITIONS_PATH = os.path.join(SCRIPT_DIR, "edo_definitions.json")
+
+COMPUTED_DIR = os.path.join(SCRIPT_DIR, "computed")
+"""
+Default folder of tuning configs generated with `--compute`, kept apart from the official notations
+as they rarely match them.
+"""
+
+CACHE_DIR = os.path.join(SCRIPT_DIR, "..", "..", "scripts", ".cache")
+
+LIGATURES_PATH = os.path.join(CACHE_DIR, "sagittal_ligatures.json")
+"""
+On-disk cache of `ligature_table()`, rebuilt whenever this script changes.
+"""
+
+LIGATURE_SHAFTS = range(-3, 4)
+"""
+Shaft deltas precomputed for every symbol in `COMPLEMENTS`. Deltas outside of this range never make
+a valid ligature.
+"""
+
+
+def _make_ligature(symbol: str, shafts: int, downward: bool) -> str | None:
+    ligature = add_shafts(symbol, shafts)
+    if ligature is NO_LIGATURE or not downward:
+        return ligature
+    return flip(ligature)
+
+
+@functools.cache
+def ligature_table() -> dict[tuple[str, int, bool], str | None]:
+    """
+    Ligatures of every upward symbol in `COMPLEMENTS` (and its complement), keyed by
+    `(symbol, shafts, downward)`: the symbol with `shafts` shafts added, flipped if `downward`.
+    Invalid ligatures are `NO_LIGATURE`.
+
+    Loaded from `LIGATURES_PATH` if it was built by the current version of this script.
+    """
+    source = source_hash()
+
+    try:
+        with open(LIGATURES_PATH, "r") as f:
+            cached = json.load(f)
+        if cached["source"] == source:
+            return {
+                (symbol, shafts, downward): ligature
+                for (symbol, shafts, downward, ligature) in cached["ligatures"]
+            }
+    except (OSError, ValueError, KeyError):
+        pass
+
+    table = {
+        (symbol, shafts, downward): _make_ligature(symbol, shafts, downward)
+        for symbol in COMPLEMENTS
+        for shafts in LIGATURE_SHAFTS
+        for downward in (False, True)
+    }
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(LIGATURES_PATH, "w") as f:
+            json.dump({"source": source, "ligatures": [[*key, ligature] for (key, ligature) in table.items()]}, f)
+    except OSError:
+        # The cache is only an optimisation.
+        pass
+
+    return table
+
+
+def ligature(symbol: str, shafts: int, downward: bool) -> str | None:
+    """
+    Looks up `add_shafts(symbol, shafts)`, flipped if `downward`, in `ligature_table()`. Symbols that
+    aren't in the table are computed once and added to it.
+    """
+    table = ligature_table()
+    key = (symbol, shafts, downward)
+    if key not in table:
+        table[key] = _make_ligature(symbol, shafts, downward)
+    return table[key]
+
+
+def make_revo(apotomes: int, edosteps: int, step_symbols: list[str], apotome_size: int) -> str | None:
     """
     Generates the revo Sagittal ASCII config based on the number of apotomes and edosteps.
 
@@ -369,13 +512,15 @@ def make_revo(apotomes: int, edosteps: int, step_symbols: list[str], apotome_siz
     - If `edosteps` is opposite sign of `apotomes`, we take the apotome complement symbol of that
       many `edosteps` (now there will either be 2 or 4 shafts)
         - Otherwise, use the single shaft upward symbol.
-    - For each **extra** apotome, add 2 shafts. If shaft exceeds 4, raise `ShaftExceededException`.
+    - For each **extra** apotome, add 2 shafts. If shaft exceeds 4, return `NO_LIGATURE`.
         - When apotome complement is taken (e.g., apotome = 2, edosteps = -1), there is only one
           **extra** apotome --- the complement already accounts for the first apotome.
         - We cannot create a ligature for apotomes = 2 and edosteps >= 1, or likewise, for apotomes
           = -2 and edosteps <= -1.
     - Finally, if apotomes < 0, flip the symbol.
 
+    The shaft additions and flips are looked up in `ligature_table()`.
+
     ## Parameters
 
     - apotomes: number of apotomes on the accidental
@@ -416,10 +561,7 @@ def make_revo(apotomes: int, edosteps: int, step_symbols: list[str], apotome_siz
 
     if abs_apotome == 0:
         # Early return for 0 apotome, only 1 shaft needed.
-        if edosteps > 0:
-            return single_shaft_upward
-        else:
-            return flip(single_shaft_upward)
+        return ligature(single_shaft_upward, 0, edosteps < 0)
 
     use_complement = apotomes * edosteps < 0
     """
@@ -429,28 +571,44 @@ def make_revo(apotomes: int, edosteps: int, step_symbols: list[str], apotome_siz
     should_flip = apotomes < 0
     """True if should flip before returning"""
 
-    upward_symbol = ""
-
     # NOTE: The "add shaft" abstraction below is extraneous for now... however in the future when
     #       sagittals have more than 4 shafts, this would come in handy.
     if use_complement:
         # either 2 or 4 shafts (either 1 or 2 apotomes up/down and opposing direction edostep offset)
-        upward_symbol = add_shafts(
-            COMPLEMENTS[single_shaft_upward], (abs_apotome - 1) * 2
-        )
+        return ligature(COMPLEMENTS[single_shaft_upward], (abs_apotome - 1) * 2, should_flip)
     else:
         # only 3 shafts (one apotome up/down and matching direction edostep offset)
-        upward_symbol = add_shafts(single_shaft_upward, abs_apotome * 2)
+        return ligature(single_shaft_upward, abs_apotome * 2, should_flip)
 
-    if should_flip:
-        return flip(upward_symbol)
+
+
+def get_fifth_edosteps(edo: int, n_th_best_fifth: int) -> int:
+    """
+    Number of edosteps of the nth best fifth of the edo. 1 = best fifth, 2 = second best, etc.
+    """
+    fifth_edosteps = edo * math.log2(3 / 2)
+    if fifth_edosteps % 1 < 0.5:
+        # best fifth is rounded down, after that, the sequence from 2nd best fifth onwards is +1, -1, +2, -2, +3, -3, ...
+        return round(
+            fifth_edosteps + (n_th_best_fifth // 2) * (((n_th_best_fifth - 1) % 2) * 2 - 1)
+        )
     else:
-        return upward_symbol
+        # best fifth is rounded up, after that, the sequence from 2nd best fifth onwards is -1, +1, -2, +2, -3, +3, ...
+        return round(
+            fifth_edosteps + (n_th_best_fifth // 2) * ((n_th_best_fifth % 2) * 2 - 1)
+        )
 
 
+def apotome_and_limma(edo: int, fifth_edosteps: int) -> tuple[int, int]:
+    """
+    Sizes of the apotome (sharp) and limma (diatonic semitone) in edosteps.
+    """
+    return 7 * fifth_edosteps - edo * 4, edo * 3 - 5 * fifth_edosteps
+
 
 def generate_tuning_config(
-    edo: int, n_th_best_fifth: int, revo: bool, step_symbols: list[str]
+    edo: int, n_th_best_fifth: int, revo: bool, step_symbols: list[str],
+    computed_accuracy: str | None = None,
 ) -> str:
     """
     Generates a tuning configuration for a given EDO and the nth best fifth.
@@ -463,6 +621,9 @@ def generate_tuning_config(
     - step_symbols (list[str]): The sagittal symbols as ASCII sorted in increasing edosteps. Only
       single-shaft upward symbols need to be provided. If empty list, all notes of the edo should be
       reachable using only sharps and flats.
+    - computed_accuracy (str | None): The accuracy level ("promethean" or "athenian") whose capture
+      zones `step_symbols` were computed from with `--compute`, or `None` if they come from
+      edo_definitions.json.
 
     ## Returns:
 
@@ -477,22 +638,11 @@ def generate_tuning_config(
     )
     print(f"     symbols: {' '.join(step_symbols)}")
 
-    fifth_edosteps = edo * math.log2(3 / 2)
-    if fifth_edosteps % 1 < 0.5:
-        # best fifth is rounded down, after that, the sequence from 2nd best fifth onwards is +1, -1, +2, -2, +3, -3, ...
-        fifth_edosteps = round(
-            fifth_edosteps + (n_th_best_fifth // 2) * (((n_th_best_fifth - 1) % 2) * 2 - 1)
-        )
-    else:
-        # best fifth is rounded up, after that, the sequence from 2nd best fifth onwards is -1, +1, -2, +2, -3, +3, ...
-        fifth_edosteps = round(
-            fifth_edosteps + (n_th_best_fifth // 2) * ((n_th_best_fifth % 2) * 2 - 1)
-        )
+    fifth_edosteps = get_fifth_edosteps(edo, n_th_best_fifth)
 
     print(f"Using fifth stepsize: {fifth_edosteps}\\{edo}")
 
-    APOTOME = 7 * fifth_edosteps - edo * 4
-    LIMMA = edo * 3 - 5 * fifth_edosteps
+    (APOTOME, LIMMA) = apotome_and_limma(edo, fifth_edosteps)
 
     is_rose = APOTOME <= 0
     """
@@ -625,15 +775,15 @@ def generate_tuning_config(
                     # affects the need to specify "natural" as an important ligature.
                     continue
 
-                if (apotome == 2 and edostep >= 1) or (apotome == -2 and edostep <= -1):
-                    # No valid ligature/symbol for accidentals above/below double sharp/flat
-                    # /X\ and \Y/ are the limits of Promethean Sagittal.
-                    continue
-
                 revo_symbol = make_revo(
                     apotome, edostep, step_symbols, APOTOME
                 )
 
+                if revo_symbol is NO_LIGATURE:
+                    # No valid ligature/symbol for accidentals above/below double sharp/flat
+                    # /X\ and \Y/ are the limits of Promethean Sagittal.
+                    continue
+
                 assert revo_symbol != "", "Revo symbol cannot be empty."
 
                 revo_symbol_escaped = escape_symbol_code(revo_symbol)
@@ -651,17 +801,27 @@ def generate_tuning_config(
     For `sec()` declaration.
     """
 
+    # Every symbol used in the tuning config is declared as a secondary symbol too.
+    validate_symbols(*(escaped_sagittal for (_, escaped_sagittal, _) in secondary_symbols))
+
     secondary_symbols.sort(key=lambda x: len(x[0]), reverse=True)
 
     for (sagittal, escaped_sagittal, cents) in secondary_symbols:
         SEC += f"{'\'' + escaped_sagittal + '\'':<13} {escaped_sagittal:<13} {cents:<.10f}c\n" # EPSILON > 5e-9
 
+    if computed_accuracy is None:
+        source = """// Generated by tunings/sagittal/generate_edo.py, based on the EDO definitions in
+// tunings/sagittal/edo_definitions.json taken from
+// https://github.com/Sagittal/sagittal-system/blob/main/src/notations/edo/definitions.ts"""
+    else:
+        source = f"""// Generated by tunings/sagittal/generate_edo.py --compute. This edo has no EDO definition, the
+// symbol of each edostep is the {computed_accuracy.capitalize()} symbol whose capture zone contains its size in
+// cents. This can differ from the official Sagittal notation of the edo."""
+
     tuning_config = f"""
 // Sagittal notation for {edo_name} EDO ({"Revo" if revo else "Evo"} variant)
 //
-// Generated by tunings/sagittal/generate_edo.py, based on the EDO definitions in
-// tunings/sagittal/edo_definitions.json taken from
-// https://github.com/Sagittal/sagittal-system/blob/main/src/notations/edo/definitions.ts
+{source}
 //
 // Apotome: {APOTOME:4} steps
 // Limma:   {LIMMA:4} steps
@@ -689,64 +849,416 @@ sec()
     return tuning_config
 
 
+FINGERPRINTS_PATH = os.path.join(CACHE_DIR, "sagittal_fingerprints.json")
+"""
+Fingerprint of the edo definition and of this script each generated file was made from, with the
+hash of the file's content. A file is only regenerated when its fingerprint changes or it was
+modified.
+"""
+
+VARIANTS = {
+    "revo": "{}edo revo.txt",
+    # Evo variant is default without "revo" in the filename
+    "evo": "{}edo.txt",
+}
+"""
+File name of each variant, formatted with the edo notation name.
+"""
+
+
+def source_hash() -> str:
+    """
+    Hash of this script's source code, which includes the settings above.
+    """
+    with open(__file__, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def edo_fingerprint(source: str, edo_notation_definition: dict) -> str:
+    definition = json.dumps(edo_notation_definition, sort_keys=True)
+    return hashlib.sha256(f"{source}\n{definition}".encode()).hexdigest()
+
+
+def content_hash(path: str) -> str | None:
+    try:
+        with open(path, "r") as f:
+            return hashlib.sha256(f.read().encode()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def write_if_changed(path: str, content: str) -> bool:
+    """
+    Writes `content` to `path` unless the file already contains it. Returns `True` if written.
+    """
+    try:
+        with open(path, "r") as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+
+    with open(path, "w") as f:
+        f.write(content)
+    return True
+
+
+def parse_edo_definition(
+    edo_notation_name: str, edo_notation_definition: dict
+) -> tuple[int, int, list[str]] | None:
+    """
+    Returns `(edo, nth_best_fifth, step_symbols)` of an edo in edo_definitions.json, or `None` if it
+    shouldn't be generated.
+    """
+    superset_edo_name = edo_notation_definition.get("supersetEdoNotationName")
+    if superset_edo_name is not None:
+        # If not provided, this edo is a subset edo, don't autogenerate it.
+        #
+        # if stepDefinitions is an empty list, it means that pyth accidentals are sufficient.
+        print(f"Skipping {edo_notation_name} as it is a subset edo of {superset_edo_name}")
+        return None
+    (edo, nth_best_fifth) = edo_of_name(edo_notation_name)
+
+    step_definition: list[dict] = edo_notation_definition.get("stepDefinitions")
+
+    if step_definition is None:
+        raise ValueError(
+            f"Step definitions for {edo_notation_name} are not provided in the edo_definitions.json file."
+        )
+
+    step_symbols: list[str] = []
+
+    for step_def in step_definition:
+        sagitype = step_def.get("sagitype")
+
+        if sagitype is None:
+            raise ValueError(
+                f"Sagittal ASCII for step definition {step_def} in {edo_notation_name} is not provided in the edo_definitions.json file."
+            )
+
+        step_symbols.append(sagitype)
+
+    # Check that step symbols are supported by Promethean Sagittal (e.g., 581 edo uses
+    # accent symbols not available in MuseScore)
+
+    if not all(c in PROMETHEAN_CHAR_WHITELIST for c in "".join(step_symbols)):
+        print(
+            f"Skipping {edo_notation_name} edo as it contains Sagittal symbols outside of Promethean: {step_symbols}"
+        )
+        return None
+
+    return edo, nth_best_fifth, step_symbols
+
+
+def resolve_superset(edo_notation_name: str, edo_definitions: dict) -> str:
+    """
+    Follows the `supersetEdoNotationName` chain of an edo to the edo whose notation it uses.
+    """
+    seen = [edo_notation_name]
+    while True:
+        superset_edo_name = edo_definitions[seen[-1]].get("supersetEdoNotationName")
+        if superset_edo_name is None:
+            return seen[-1]
+        if superset_edo_name in seen or superset_edo_name not in edo_definitions:
+            raise ValueError(f"Invalid supersetEdoNotationName chain: {' -> '.join(seen + [superset_edo_name])}")
+        seen.append(superset_edo_name)
+
+
+def edo_of_name(edo_notation_name: str) -> tuple[int, int]:
+    """
+    Returns `(edo, nth_best_fifth)` of an edo notation name, e.g. `(35, 2)` for `35b`.
+    """
+    edo_str = edo_notation_name.rstrip("b")
+    return int(edo_str), len(edo_notation_name) - len(edo_str) + 1
+
+
+def select_edos(
+    edo_definitions: dict, edo_specs: list[str], filter_expression: str | None
+) -> list[str]:
+    """
+    Returns the names of the edos matching any of `edo_specs` (names like `311` or `35b`, or ranges
+    like `100-200`, which include the nth best fifth variants) and `filter_expression`, in
+    definition order. All edos match if neither is given.
+
+    `filter_expression` is a Python expression of `name`, `edo`, `nth_best_fifth` and `steps` (number
+    of step symbols, of the superset edo for subset edos). Errors raised by the expression are
+    reported as `ValueError`s.
+    """
+    names: list[str] = []
+
+    for spec in edo_specs:
+        range_match = re.fullmatch(r"(\d+)-(\d+)", spec)
+        if range_match:
+            (first, last) = (int(range_match[1]), int(range_match[2]))
+            names += [name for name in edo_definitions if first <= edo_of_name(name)[0] <= last]
+        elif spec in edo_definitions:
+            names.append(spec)
+        else:
+            raise ValueError(f"{spec} is not in {os.path.basename(DEFINITIONS_PATH)}")
+
+    if not edo_specs:
+        names = list(edo_definitions)
+
+    if filter_expression is not None:
+        code = compile(filter_expression, "--filter", "eval")
+
+        def matches(name: str) -> bool:
+            (edo, nth_best_fifth) = edo_of_name(name)
+            step_definitions = edo_definitions[resolve_superset(name, edo_definitions)].get("stepDefinitions")
+            try:
+                return bool(eval(code, {"__builtins__": {}}, {
+                    "name": name,
+                    "edo": edo,
+                    "nth_best_fifth": nth_best_fifth,
+                    "steps": len(step_definitions) if step_definitions is not None else None,
+                }))
+            except Exception as e:
+                raise ValueError(f"--filter failed for {name}: {type(e).__name__}: {e}") from e
+
+        names = [name for name in names if matches(name)]
+
+    return list(dict.fromkeys(names))
+
+
+def parse_edo_names(spec: str) -> list[str]:
+    """
+    Parses an edo name like `311` or `35b` (2nd best fifth), or a range like `100-5000` (best fifths
+    only) into a list of edo notation names.
+    """
+    range_match = re.fullmatch(r"(\d+)-(\d+)", spec)
+    if range_match:
+        (first, last) = (int(range_match[1]), int(range_match[2]))
+        if not 1 <= first <= last:
+            raise ValueError(f"Invalid edo range: {spec}")
+        return [str(edo) for edo in range(first, last + 1)]
+    if re.fullmatch(r"[1-9]\d*b*", spec):
+        return [spec]
+    raise ValueError(f"Invalid edo: {spec} (expected e.g. 311, 35b or 100-200)")
+
+
+def computed_edo_definitions(edo_notation_names: list[str], accuracy: str) -> dict[str, dict]:
+    """
+    Derives edo definitions (in the format of edo_definitions.json) from the capture zones of the
+    accuracy level ("promethean" or "athenian"), for edos that aren't in edo_definitions.json.
+
+    The symbol of k edosteps is the symbol whose capture zone contains k steps in cents. By the
+    convention of `make_revo`, there are `max(apotome, limma) // 2` step symbols. Edos whose steps
+    are too small to get distinct symbols, or too large to get one, can't be notated and are left out.
+
+    The step sizes of all edos are looked up in one batch.
+    """
+    zones = ACCURACY_ZONES[accuracy]
+
+    num_steps: list[int] = []
+    cents_values: list[float] = []
+
+    for edo_notation_name in edo_notation_names:
+        (edo, nth_best_fifth) = edo_of_name(edo_notation_name)
+        (apotome, limma) = apotome_and_limma(edo, get_fifth_edosteps(edo, nth_best_fifth))
+        num_steps.append(max(abs(apotome), abs(limma)) // 2)
+        cents_values += [k * 1200 / edo for k in range(1, num_steps[-1] + 1)]
+
+    symbols = zones.symbols_of(cents_values)
+
+    edo_definitions = {}
+    start = 0
+
+    for (edo_notation_name, steps) in zip(edo_notation_names, num_steps):
+        step_symbols = symbols[start:start + steps]
+        start += steps
+
+        if None in step_symbols:
+            print(f"Skipping {edo_notation_name} edo as its steps are outside of the {accuracy} capture zones")
+            continue
+        if len(set(step_symbols)) != steps:
+            print(f"Skipping {edo_notation_name} edo as its {steps} steps don't have distinct {accuracy} symbols")
+            continue
+
+        edo_definitions[edo_notation_name] = {
+            "stepDefinitions": [{"sagitype": symbol} for symbol in step_symbols],
+            "computedAccuracy": accuracy,
+        }
+
+    return edo_definitions
+
+
+def generate_edo(
+    edo: int, nth_best_fifth: int, step_symbols: list[str], variants: list[str],
+    computed_accuracy: str | None = None,
+) -> tuple[str, dict[str, str]]:
+    """
+    Generates the tuning configs of an edo for each of `variants` ("revo" and/or "evo"), in a worker
+    process. `computed_accuracy` is the `computedAccuracy` of computed edo definitions.
+
+    Returns `(log, tuning_configs)`, where `tuning_configs` maps variants to tuning configs. The log
+    is returned instead of printed so that the logs of edos generated in parallel don't interleave.
+    """
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        tuning_configs = {
+            variant: generate_tuning_config(
+                edo, nth_best_fifth, variant == "revo", step_symbols, computed_accuracy
+            )
+            for variant in variants
+        }
+    return log.getvalue(), tuning_configs
+
+
 def main():
-    with open("tunings/sagittal/edo_definitions.json", "r") as f:
+    argparser = argparse.ArgumentParser(
+        "generate_edo", description="Generates Sagittal tuning configs from edo_definitions.json.")
+    argparser.add_argument(
+        "--edo", action="append", default=[], metavar="NAME|FIRST-LAST",
+        help="Edo to generate, e.g. 311, 35b (2nd best fifth) or a range like 100-200. Can be given "
+        "multiple times. Subset edos generate the edo whose notation they use. (default: all edos)")
+    argparser.add_argument(
+        "--filter", metavar="EXPRESSION",
+        help="Only generate edos for which this Python expression of name, edo, nth_best_fifth and "
+        "steps (number of step symbols) is true, e.g. \"edo < 100 and steps <= 2\".")
+    argparser.add_argument(
+        "--compute", action="append", default=[], metavar="NAME|FIRST-LAST",
+        help="Edo to notate from the capture zones of --accuracy, e.g. 1000, 35b or 100-5000. Edos in "
+        "the edo definitions use their definition instead. Can be given multiple times. Only these edos are generated "
+        "unless --edo or --filter is given too.")
+    argparser.add_argument(
+        "--accuracy", choices=list(ACCURACY_ZONES), default="promethean",
+        help="Capture zones used by --compute. (default: promethean)")
+    argparser.add_argument(
+        "--variant", choices=["revo", "evo", "both"], default="both",
+        help="Which variants to generate. (default: both)")
+    argparser.add_argument(
+        "-o", "--output-dir", metavar="DIR",
+        help="Folder to write the tuning configs to. (default: the folder of this script, or its "
+        "computed/ subfolder for edos notated with --compute)")
+    argparser.add_argument(
+        "--definitions", default=DEFINITIONS_PATH, metavar="PATH",
+        help="Path of the edo definitions. (default: edo_definitions.json next to this script)")
+    argparser.add_argument(
+        "--force", action="store_true",
+        help="Regenerate edos even if their definition and this script haven't changed.")
+    argparser.add_argument(
+        "-j", "--jobs", type=int, default=os.cpu_count() or 1,
+        help="Number of edos to generate in parallel. (default: number of CPUs)")
+    args = argparser.parse_args()
+
+    variants = list(VARIANTS) if args.variant == "both" else [args.variant]
+
+    with open(args.definitions, "r") as f:
         edo_definitions = json.load(f)
-        for edo_notation_name, edo_notation_definition in edo_definitions.items():
-            superset_edo_name = edo_notation_definition.get("supersetEdoNotationName")
-            if superset_edo_name is not None:
-                # If not provided, this edo is a subset edo, don't autogenerate it.
-                #
-                # if stepDefinitions is an empty list, it means that pyth accidentals are sufficient.
-                print(f"Skipping {edo_notation_name} as it is a subset edo of {superset_edo_name}")
-                continue
-            edo_str: str = edo_notation_name
-            nth_best_fifth = 1
-            while edo_str.endswith("b"):
-                nth_best_fifth += 1
-                edo_str = edo_str[:-1]
-            edo = int(edo_str)
-
-            step_definition: list[dict] = edo_notation_definition.get("stepDefinitions")
-
-            if step_definition is None:
-                raise ValueError(
-                    f"Step definitions for {edo_notation_name} are not provided in the edo_definitions.json file."
-                )
 
-            step_symbols: list[str] = []
+    try:
+        names = []
+        if args.edo or args.filter is not None or not args.compute:
+            names = select_edos(edo_definitions, args.edo, args.filter)
 
-            for step_def in step_definition:
-                sagitype = step_def.get("sagitype")
+        compute_names = [name for spec in args.compute for name in parse_edo_names(spec)]
+    except (ValueError, SyntaxError) as e:
+        argparser.error(str(e))
 
-                if sagitype is None:
-                    raise ValueError(
-                        f"Sagittal ASCII for step definition {step_def} in {edo_notation_name} is not provided in the edo_definitions.json file."
-                    )
+    # Edos in the definitions use their definition.
+    computed = computed_edo_definitions(
+        [name for name in dict.fromkeys(compute_names) if name not in edo_definitions], args.accuracy
+    )
+    edo_definitions.update(computed)
+    names = list(dict.fromkeys(names + [name for name in compute_names if name in edo_definitions]))
 
-                step_symbols.append(sagitype)
+    try:
+        with open(FINGERPRINTS_PATH, "r") as f:
+            fingerprints = json.load(f)
+    except (OSError, ValueError):
+        fingerprints = {}
 
-            # Check that step symbols are supported by Promethean Sagittal (e.g., 581 edo uses
-            # accent symbols not available in MuseScore)
+    source = source_hash()
 
-            if not all(c in PROMETHEAN_CHAR_WHITELIST for c in "".join(step_symbols)):
-                print(
-                    f"Skipping {edo_notation_name} edo as it contains Sagittal symbols outside of Promethean: {step_symbols}"
-                )
+    todo: dict[str, tuple[int, int, list[str], dict[str, tuple[str, str]]]] = {}
+    """
+    Edo notation name to `(edo, nth_best_fifth, step_symbols, outputs)`, where outputs maps each
+    variant to generate to `(path, fingerprint)`.
+    """
+    unchanged = 0
+    selected = set(names)
+
+    for edo_notation_name in names:
+        notation_name = resolve_superset(edo_notation_name, edo_definitions)
+        if notation_name != edo_notation_name:
+            # Subset edos aren't autogenerated, they use the notation of their superset edo.
+            if notation_name in selected:
+                print(f"Skipping {edo_notation_name} as it is a subset edo of {notation_name}")
                 continue
+            print(f"{edo_notation_name} is a subset edo of {notation_name}, generating {notation_name} instead")
+            selected.add(notation_name)
+            edo_notation_name = notation_name
+
+        edo_notation_definition = edo_definitions[edo_notation_name]
+        parsed = parse_edo_definition(edo_notation_name, edo_notation_definition)
+        if parsed is None:
+            continue
+
+        fingerprint = edo_fingerprint(source, edo_notation_definition)
+        outputs = {}
+
+        output_dir = args.output_dir
+        if output_dir is None:
+            output_dir = COMPUTED_DIR if "computedAccuracy" in edo_notation_definition else SCRIPT_DIR
+
+        for variant in variants:
+            path = os.path.join(output_dir, VARIANTS[variant].format(edo_notation_name))
+            cached = fingerprints.get(os.path.abspath(path))
+            if (
+                args.force or cached is None or cached["fingerprint"] != fingerprint
+                or content_hash(path) != cached["hash"]
+            ):
+                outputs[variant] = (path, fingerprint)
+
+        if not outputs:
+            unchanged += 1
+            continue
+
+        todo[edo_notation_name] = (*parsed, outputs)
+
+    written = 0
+
+    if todo:
+        for outputs in todo.values():
+            for (path, _) in outputs[3].values():
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        jobs = min(args.jobs, len(todo))
+        # Generating a single edo in this process is faster than starting a process pool.
+        with ProcessPoolExecutor(jobs) if jobs > 1 else contextlib.nullcontext() as executor:
+            results = (executor.map if executor is not None else map)(
+                generate_edo,
+                *zip(*[
+                    (
+                        edo, nth_best_fifth, step_symbols, list(outputs),
+                        edo_definitions[name].get("computedAccuracy"),
+                    )
+                    for (name, (edo, nth_best_fifth, step_symbols, outputs)) in todo.items()
+                ]),
+            )
+
+            for (edo_notation_name, (log, tuning_configs)) in zip(todo, results):
+                print(log, end="")
 
+                for (variant, (path, fingerprint)) in todo[edo_notation_name][3].items():
+                    tuning_config = tuning_configs[variant]
+                    if write_if_changed(path, tuning_config):
+                        print(f"Writing {os.path.relpath(path)}...")
+                        written += 1
 
-            revo_tuning_config = generate_tuning_config(edo, nth_best_fifth, True, step_symbols)
-            evo_tuning_config = generate_tuning_config(edo, nth_best_fifth, False, step_symbols)
+                    fingerprints[os.path.abspath(path)] = {
+                        "fingerprint": fingerprint,
+                        "hash": hashlib.sha256(tuning_config.encode()).hexdigest(),
+                    }
 
-            with open(f"tunings/sagittal/{edo_notation_name}edo revo.txt", "w") as revo_file:
-                print(f"Writing sagittal/{edo_notation_name}edo revo.txt...")
-                revo_file.write(revo_tuning_config)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(FINGERPRINTS_PATH, "w") as f:
+            json.dump(fingerprints, f, indent=2)
 
-            with open(f"tunings/sagittal/{edo_notation_name}edo.txt", "w") as evo_file:
-                # Evo variant is default without "revo" in the filename
-                print(f"Writing sagittal/{edo_notation_name}edo.txt...")
-                evo_file.write(evo_tuning_config)
+    print(
+        f"\nGenerated {len(todo)} edos ({written} files changed), "
+        f"{unchanged} edos unchanged since the last run."
+    )
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -40,6 +40,10 @@ The first nominal is set to A.
 
 import sys
 import math
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scripts"))
+from symbol_tables import validate_config
 
 """ 
 _______________________________________________________________
@@ -419,7 +423,10 @@ if num_arrows >= 1:
     lines.append(f"'v' \\\\ {round(-step_cents, 7)}c")
     lines.append(f"'^' / {round(step_cents, 7)}c")
 
+config = '\n'.join(lines)
+validate_config(config)
+
 with open(file_name, 'w') as f:
-    f.write('\n'.join(lines))
+    f.write(config)
     
 print(f'Created {file_name}')
\ No newline at end of file
@@ -40,6 +40,10 @@ The first nominal is set to A.
 
 import sys
 import math
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "scripts"))
+from symbol_tables import validate_symbols
 
 """
 _______________________________________________________________
@@ -356,6 +360,7 @@ lines.append(nominal_string)
 
 if NUM_SHARPS_FLATS != 0:
     pyth_symbols = [construct_pyth_symbols(apt) for apt in range(-NUM_SHARPS_FLATS, NUM_SHARPS_FLATS + 1)]
+    validate_symbols(*pyth_symbols[:NUM_SHARPS_FLATS], *pyth_symbols[NUM_SHARPS_FLATS + 1:])
     pyth_symbols[NUM_SHARPS_FLATS] = f'({round(apotome_cents, 7)}c)'
     lines.append(' '.join(pyth_symbols))
 
@@ -372,6 +377,7 @@ if num_arrows != 0:
         else:
             arrow_symbols.append('.'.join(['\\\\']*(-a)))
 
+    validate_symbols(*arrow_symbols[:num_arrows], *arrow_symbols[num_arrows + 1:])
     arrow_symbols[num_arrows] = f'({round(step_cents, 7)}c)'
 
     lines.append(' '.join(arrow_symbols))
@@ -389,6 +395,7 @@ if USE_LIGATURES:
                 continue
 
             symbols = construct_ligatured_symbols(apotomes, arrows)
+            validate_symbols(symbols)
             lines.append(f'{apotomes} {arrows} {symbols}')
 
 